@@ -0,0 +1,107 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+from concurrent.futures import ProcessPoolExecutor
+import weakref
+
+# Per node attributes computed once for a whole graph, so hover text never runs a graph algorithm per frame.
+# Every array is aligned with G.nodes; index maps a node to its position.
+
+def node_edges(G):
+    # Returns the nodes of G and its edges as an m x 2 array of positions in G.nodes (in G.edges order)
+    nodes = list(G.nodes)
+    index = {node : i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges], dtype=int).reshape(-1, 2)
+    return nodes, edges
+
+class DirectedStructure():
+    """The sparse adjacency of a graph (in G.nodes order), built once, and what follows from A ∘ A^T: whether every
+    edge (in G.edges order) is reciprocated, and the reciprocity of every node as in nx.reciprocity (nan for
+    isolated nodes). Every edge of an undirected graph counts as reciprocated"""
+
+    def __init__(self, G, edges = None):
+        self.directed = nx.is_directed(G)
+        n = G.order()
+        if edges is None:
+            edges = node_edges(G)[1]
+        rows, cols = edges[:, 0], edges[:, 1]
+
+        adjacency = sp.coo_matrix((np.ones(len(edges)), (rows, cols)), shape=(n, n))
+        self.adjacency = sp.csr_matrix(adjacency if self.directed else adjacency + adjacency.T)
+        self.adjacency.data[:] = 1
+
+        self.out_degree = np.asarray(self.adjacency.sum(axis=1)).ravel().astype(int)
+        self.in_degree = np.asarray(self.adjacency.sum(axis=0)).ravel().astype(int)
+
+        if self.directed:
+            mutual = self.adjacency.multiply(self.adjacency.T).tocsr()
+            self.reciprocal = np.asarray(mutual[rows, cols]).ravel() > 0 if len(rows) else np.zeros(0, dtype=bool)
+            overlap = np.asarray(mutual.sum(axis=1)).ravel()
+            degree = self.in_degree + self.out_degree
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self.reciprocity = np.where(degree > 0, 2 * overlap / degree, np.nan)
+        else:
+            self.reciprocal = np.ones(len(rows), dtype=bool)
+            self.reciprocity = np.where(self.out_degree > 0, 1.0, np.nan)
+
+# Graphs whose structure has already been computed, so every highlighter and attribute index over the same graph shares it
+_structure_cache = weakref.WeakKeyDictionary()
+
+def directed_structure(G):
+    # Returns the DirectedStructure of G, computed once per graph. The cached structure is checked against the
+    # graph's current nodes and edges, so a graph rewired in place (even keeping its node and edge counts) gets a
+    # new one, and only building the sparse matrices is saved.
+    nodes, edges = node_edges(G)
+    cached = _structure_cache.get(G)
+    if cached is not None and cached[0] == nodes and np.array_equal(cached[1], edges):
+        return cached[2]
+
+    structure = DirectedStructure(G, edges)
+    _structure_cache[G] = (nodes, edges, structure)
+    return structure
+
+PARALLEL_MIN_NODES = 2000 # Below this many nodes every search together takes less than starting a process pool
+
+def _eccentricities(adjacency, sources):
+    # The largest distance from every source to the nodes it can reach (unreachable nodes don't count)
+    distances = csgraph.shortest_path(adjacency, unweighted=True, indices=sources)
+    distances[np.isinf(distances)] = 0
+    return distances.max(axis=1).astype(int)
+
+def eccentricities(G, processes = None, chunk = 256):
+    # Runs a breadth first search from every node over the cached adjacency of directed_structure, chunks of sources
+    # in parallel across processes once the graph has PARALLEL_MIN_NODES nodes.
+    # For directed graphs the distances follow edge directions, like nx.single_source_shortest_path_length.
+    adjacency = directed_structure(G).adjacency
+    n = adjacency.shape[0]
+    chunks = [np.arange(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+    if len(chunks) <= 1 or processes == 1 or n < PARALLEL_MIN_NODES:
+        return np.concatenate([_eccentricities(adjacency, sources) for sources in chunks]) if chunks else np.zeros(0, dtype=int)
+
+    with ProcessPoolExecutor(processes) as executor:
+        return np.concatenate(list(executor.map(_eccentricities, [adjacency]*len(chunks), chunks)))
+
+class NodeAttributes():
+    """Degrees, reciprocities and eccentricities of every node of a graph, computed once with sparse arrays"""
+
+    def __init__(self, G, processes = None):
+        self.directed = nx.is_directed(G)
+        self.index = {node : i for i, node in enumerate(G.nodes)}
+
+        structure = directed_structure(G)
+        self.out_degree = structure.out_degree
+        self.in_degree = structure.in_degree
+        self.degree = self.in_degree + self.out_degree if self.directed else np.array([degree for node, degree in G.degree])
+        self.reciprocity = structure.reciprocity
+
+        self.eccentricity = eccentricities(G, processes)
+
+    def __getitem__(self, node):
+        """The attributes of one node as a dictionary"""
+
+        i = self.index[node]
+        attributes = {"degree" : self.degree[i], "eccentricity" : self.eccentricity[i]}
+        if self.directed:
+            attributes.update({"in_degree" : self.in_degree[i], "out_degree" : self.out_degree[i], "reciprocity" : self.reciprocity[i]})
+        return attributes
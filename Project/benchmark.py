@@ -0,0 +1,163 @@
+import argparse
+import csv
+import json
+import sys
+import time
+import numpy as np
+import networkx as nx
+import partition
+import datasets
+import instrumentation
+
+# Benchmark suite for the partitioners: runs partition.get_partition_n and partition.get_partition_multilevel on the
+# bundled networks and on planted stochastic block models of growing size, and records the wall time, phases,
+# candidate moves scored per second, time scoring moves versus bookkeeping (from an instrumentation.PartitionTrace),
+# final log-likelihood, and NMI against the planted blocks of each run. The large planted models only run the
+# multilevel method, to show how it scales well past the sizes the single level phases can handle.
+# Results are written as JSON and CSV, and can be checked against a baseline file so that a speedup in the
+# partitioner can't silently lower the quality of its partitions.
+#
+# usage  : python benchmark.py [--output results] [--baseline results.json] [--trials 2] [--seed 0]
+
+NETWORKS = {
+    "karate" : lambda : datasets.load_network("karate.gml"),
+    "yeast spliceosome" : lambda : datasets.load_network("yeast_spliceosome.gml"),
+    "grass web" : lambda : datasets.load_network("grass_web.gml"),
+    "metabolism" : lambda : datasets.load_network("metabolism_afulgidus.gml"),
+    "neural" : datasets.load_neural,
+    "HVR 1" : lambda : datasets.load_edge_list("HVR_1.txt"),
+    "HVR 5" : lambda : datasets.load_edge_list("HVR_5.txt"),
+}
+
+SBM_SIZES = [100, 200, 400, 800]
+LARGE_SBM_SIZES = [10000, 100000] # Only run with the methods in LARGE_METHODS
+LARGE_METHODS = ["multilevel"]
+
+def planted_partition(n, blocks = 4, degree = 10, mixing = 0.2, seed = 0):
+    """Generates a stochastic block model with n nodes in equal blocks and the given mean degree, where mixing is the
+    fraction of each node's edges that leave its block. Returns the graph and its planted blocks"""
+
+    sizes = [n // blocks] * blocks
+    p_in = degree * (1 - mixing) / (sizes[0] - 1)
+    p_out = degree * mixing / (n - sizes[0])
+    probabilities = [[p_in if r == s else p_out for s in range(blocks)] for r in range(blocks)]
+    G = nx.stochastic_block_model(sizes, probabilities, seed = seed)
+    return G, np.repeat(np.arange(blocks), sizes)
+
+def normalized_mutual_information(x, y):
+    """The mutual information of two partitions normalized by the mean of their entropies (1 when they match)"""
+
+    _, x = np.unique(x, return_inverse=True)
+    _, y = np.unique(y, return_inverse=True)
+    joint = np.zeros((x.max() + 1, y.max() + 1))
+    np.add.at(joint, (x, y), 1)
+    joint /= len(x)
+
+    px, py = joint.sum(axis=1), joint.sum(axis=0)
+    nonzero = joint > 0
+    mutual = np.sum(joint[nonzero] * np.log(joint[nonzero] / np.outer(px, py)[nonzero]))
+    entropy = lambda p : -np.sum(p[p > 0] * np.log(p[p > 0]))
+    mean_entropy = (entropy(px) + entropy(py)) / 2
+    return mutual / mean_entropy if mean_entropy > 0 else 1.0
+
+def run_single_level(G, c, trials, seed, trace):
+    return partition.get_partition_runs(G, c = c, trials = trials, seed = seed, trace = trace)[1]
+
+def run_multilevel(G, c, trials, seed, trace):
+    return partition.get_partition_multilevel(G, c = c, trials = trials, seed = seed, trace = trace)
+
+METHODS = {
+    "get_partition_n" : run_single_level,
+    "multilevel" : run_multilevel,
+}
+
+def benchmark(name, G, c, method, trials, seed, truth = None):
+    # The trace counts the phases and candidate moves the optimizer actually ran, at every level for multilevel
+    trace = instrumentation.PartitionTrace()
+    arrays = partition.graph_arrays(G) # converted once, outside the timing, for the method and the final log-likelihood
+    start = time.perf_counter()
+    z = METHODS[method](arrays, c, trials, seed, trace)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "network" : name,
+        "n" : G.order(),
+        "m" : G.size(),
+        "c" : c,
+        "method" : method,
+        "time" : elapsed,
+        "phases" : len(trace.phases),
+        "moves_scored" : trace.moves_scored(),
+        "moves_per_second" : trace.moves_scored() / elapsed,
+        "scoring_time" : trace.scoring_time(),
+        "bookkeeping_time" : trace.bookkeeping_time(),
+        "logL" : float(partition.dcsbm_LogL(*partition.tabulate_ek(arrays, z, c))),
+        "nmi" : float(normalized_mutual_information(z, truth)) if truth is not None else None,
+    }
+
+def regressions(results, baseline, max_slowdown, max_logL_drop):
+    """Compares results to the baseline results for the same network and method. Returns a description of every run
+    that got more than max_slowdown times slower, or whose log-likelihood dropped by more than the fraction max_logL_drop"""
+
+    previous = {(result["network"], result["method"]) : result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get((result["network"], result["method"]))
+        if before is None:
+            continue
+        if result["time"] > before["time"] * max_slowdown:
+            found.append("{} / {}: {:.2f}s is over {}x the baseline {:.2f}s".format(result["network"], result["method"], result["time"], max_slowdown, before["time"]))
+        if result["logL"] < before["logL"] - abs(before["logL"]) * max_logL_drop:
+            found.append("{} / {}: log-likelihood {:.2f} is below the baseline {:.2f}".format(result["network"], result["method"], result["logL"], before["logL"]))
+    return found
+
+def write_results(results, output):
+    with open(output + ".json", "w") as file:
+        json.dump(results, file, indent=2)
+    with open(output + ".csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and quality of the partition methods on bundled and planted networks")
+    parser.add_argument("--c", type=int, default=2, help="number of groups for the bundled networks (planted ones use their block count)")
+    parser.add_argument("--trials", type=int, default=2, help="restarts per method")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", type=int, nargs="*", default=SBM_SIZES, help="node counts of the planted block models")
+    parser.add_argument("--large-sizes", type=int, nargs="*", default=LARGE_SBM_SIZES, help="node counts of the planted block models only the multilevel method runs on")
+    parser.add_argument("--methods", nargs="*", default=list(METHODS), choices=list(METHODS))
+    parser.add_argument("--output", default="benchmark_results", help="writes OUTPUT.json and OUTPUT.csv")
+    parser.add_argument("--baseline", help="a previous OUTPUT.json to check for regressions against")
+    parser.add_argument("--max-slowdown", type=float, default=1.25, help="allowed ratio of time to the baseline time")
+    parser.add_argument("--max-logl-drop", type=float, default=0.001, help="allowed relative drop in log-likelihood from the baseline")
+    args = parser.parse_args()
+
+    graphs = [(name, load(), args.c, None, args.methods) for name, load in NETWORKS.items()]
+    for n in args.sizes:
+        G, truth = planted_partition(n, seed = args.seed)
+        graphs.append(("sbm {}".format(n), G, int(truth.max()) + 1, truth, args.methods))
+    for n in args.large_sizes:
+        G, truth = planted_partition(n, seed = args.seed)
+        graphs.append(("sbm {}".format(n), G, int(truth.max()) + 1, truth, [method for method in args.methods if method in LARGE_METHODS]))
+
+    results = []
+    print("{:<20} {:>6} {:>6} {:<16} {:>10} {:>7} {:>12} {:>14} {:>6}".format("network", "n", "m", "method", "time (s)", "phases", "moves/s", "log-likelihood", "NMI"))
+    for name, G, c, truth, methods in graphs:
+        for method in methods:
+            result = benchmark(name, G, c, method, args.trials, args.seed, truth)
+            results.append(result)
+            print("{:<20} {:>6} {:>6} {:<16} {:>10.2f} {:>7} {:>12} {:>14.2f} {:>6}".format(
+                name, result["n"], result["m"], method, result["time"],
+                result["phases"], "{:.0f}".format(result["moves_per_second"]),
+                result["logL"],
+                "-" if result["nmi"] is None else "{:.3f}".format(result["nmi"])))
+
+    write_results(results, args.output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.max_slowdown, args.max_logl_drop)
+        for regression in found:
+            print("REGRESSION " + regression)
+        sys.exit(1 if found else 0)
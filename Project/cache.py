@@ -0,0 +1,91 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+import numpy as np
+from pathlib import Path
+
+# Content addressed caches of NumPy arrays on disk. Entries are keyed by hashes of what produced them (the graph's
+# edge set, the algorithm and its parameters), so a changed graph or setting can never pick up a stale entry.
+
+CACHE_DIR = Path(__file__).parent / "./data/cache/"
+
+def graph_hash(G):
+    """Hashes a graph by its node order, directedness, and edge set (independent of the order edges were added)"""
+
+    # The edges as positions in G.nodes, so any hashable labels work and entries indexed by node position (layouts,
+    # per node arrays) aren't shared between graphs that list the same nodes in a different order
+    nodes = list(G.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()], dtype=np.int64).reshape(-1, 2)
+    if not G.is_directed():
+        edges.sort(axis=1)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+    digest = hashlib.sha256()
+    digest.update(b"directed" if G.is_directed() else b"undirected")
+    digest.update(repr(nodes).encode())
+    digest.update(edges.tobytes())
+    return digest.hexdigest()
+
+def make_key(*parts):
+    """Combines the parts that identify an entry (hashes, names, parameters) into a single key"""
+
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+class ArrayCache():
+    """A directory of .npz entries. Entries are written to a temporary file and renamed into place, so concurrent
+    writers never leave a partial entry behind, and the least recently used entries are evicted once the
+    directory grows past max_bytes"""
+
+    def __init__(self, name, max_bytes=256 * 2**20):
+        self.directory = CACHE_DIR / name
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.directory / "{}.npz".format(key)
+
+    def load(self, key):
+        """Returns the dictionary of arrays stored under key, or None if there is no readable entry"""
+
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name : data[name] for name in data.files}
+            os.utime(path) # Mark it as recently used
+            return arrays
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zipfile.BadZipFile) as err:
+            print("Ignoring unreadable cache entry {}: {}".format(path.name, err))
+            return None
+
+    def save(self, key, **arrays):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=str(self.directory), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.savez_compressed(file, **arrays)
+            os.replace(temp, str(self.path(key)))
+        except BaseException:
+            os.unlink(temp)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                entries.append((path.stat().st_mtime, path.stat().st_size, path))
+            except FileNotFoundError:
+                pass # Another writer evicted it first
+
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,41 @@
+import numpy as np
+import networkx as nx
+from pathlib import Path
+
+# Loaders for the networks bundled in ./data. Every loader relabels the nodes 0 to n-1 because the partition and
+# highlighter code index arrays by node.
+
+def data_path(filename):
+    return Path(__file__).parent / "./data/" / filename
+
+def load_network(filename):
+    return nx.convert_node_labels_to_integers(nx.read_gml(str(data_path(filename)), label='id')) # map node names to integers (0:n-1) [because indexing]
+
+def load_edge_list(filename):
+    """Loads a comma separated edge list like the HVR_*.txt files as a simple undirected graph"""
+
+    G = nx.read_edgelist(str(data_path(filename)), delimiter=",", nodetype=int)
+    G.remove_edges_from(nx.selfloop_edges(G))
+    return nx.convert_node_labels_to_integers(G)
+
+def load_neural():
+    """Loads the p. pacificus neural network, simplified from a multigraph"""
+
+    g_multi = nx.convert_node_labels_to_integers(nx.read_graphml(str(data_path("p.pacificus_neural.synaptic_1.graphml")))) # map node names to integers (0:n-1) [because indexing]
+    g_neural = nx.Graph()                     # G will be a simple graph
+    g_neural.add_edges_from(g_multi.edges())        # G is now a simplified Gmulti (tricky :)
+    return g_neural
+
+def load_edge_stream(filename):
+    """Loads a comma separated edge list like the HVR_*.txt files as a stream of edges, with the line order as time.
+    Returns the simple undirected graph of every edge in the stream, and the stream as an m x 2 array of its edges"""
+
+    pairs = np.loadtxt(str(data_path(filename)), delimiter=",", dtype=int).reshape(-1, 2)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    labels, stream = np.unique(pairs, return_inverse=True)
+    stream = stream.reshape(-1, 2)
+
+    G = nx.Graph()
+    G.add_nodes_from(range(len(labels)))
+    G.add_edges_from(stream.tolist())
+    return G, stream
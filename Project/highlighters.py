@@ -1,7 +1,68 @@
 import numpy as np
 import networkx as nx
-import colorsys
 import math
+import threading
+import heapq
+import cache
+import layouts
+import attributes
+
+# What a highlighter's tick can report as changed, so the renderers only rebuild what they need to
+NODE_COLORS = "node_colors"
+EDGE_COLORS = "edge_colors"
+LAYOUT = "layout"
+EDGES = "edges" # Every edge buffer has to be rebuilt
+EDGE_SLOTS = "edge_slots" # Only the edge slots in changed_edge_slots changed
+NODE_VISIBILITY = "node_visibility"
+
+# Layouts are seeded so the ones cached on disk are the ones that would have been computed
+LAYOUT_SEED = 0
+
+LAYOUTS = {
+    "spring" : nx.spring_layout,
+    "barnes hut" : layouts.barnes_hut_layout,
+}
+
+# Graphs with more nodes than this are laid out with the Barnes-Hut layout by default, since spring_layout is quadratic
+LARGE_GRAPH = 2000
+
+layout_cache = cache.ArrayCache("layouts")
+shared_layouts = {} # Layouts already computed in this process, by their cache key
+
+def layout_key(graph, algorithm, seed, params):
+    return cache.make_key(cache.graph_hash(graph), algorithm, sorted(params.items()), seed)
+
+def find_shared_layout(graph, key):
+    """Returns the layout stored under key in this process or on disk, or None if it hasn't been computed"""
+
+    if key not in shared_layouts:
+        cached = layout_cache.load(key)
+        if cached is None or len(cached["positions"]) != graph.number_of_nodes():
+            return None
+        shared_layouts[key] = dict(zip(graph.nodes, cached["positions"]))
+
+    return shared_layouts[key]
+
+def store_shared_layout(graph, key, positions):
+    """Stores the n x 3 positions of the nodes of graph (in graph.nodes order) under key, in this process and on disk"""
+
+    positions = np.array(positions, dtype=np.float32).reshape(graph.number_of_nodes(), -1)
+    layout_cache.save(key, positions=positions)
+    shared_layouts[key] = dict(zip(graph.nodes, positions))
+    return shared_layouts[key]
+
+def get_shared_layout(graph, algorithm = "spring", seed = LAYOUT_SEED, **params):
+    """Returns the layout of graph (a dictionary from each node to its position) with one of LAYOUTS, computing it
+    at most once per process for the same graph, algorithm, parameters and seed. The positions are also saved to
+    disk as float32 arrays, so later runs don't compute them again"""
+
+    key = layout_key(graph, algorithm, seed, params)
+    layout = find_shared_layout(graph, key)
+    if layout is None:
+        layout = LAYOUTS[algorithm](graph, seed=seed, **params)
+        layout = store_shared_layout(graph, key, [layout[node] for node in graph.nodes])
+
+    return layout
 
 # This defines the way the surface will interact with lighting in a fine grain manner
 class Material():
@@ -15,12 +76,70 @@ class Material():
         return "Ambient: ({}, {}, {}), Diffuse: ({}, {}, {}), Specular: ({}, {}, {}), Shininess: {}".format(
             *self.ambient, *self.diffuse, *self.specular, self.shininess)
 
+def hsv_to_rgb(h, s, v):
+    """Vectorized colorsys.hsv_to_rgb: accepts arrays (or scalars) that broadcast together, and returns their rgb
+    colors stacked along a last axis of length 3"""
+
+    h, s, v = np.broadcast_arrays(np.asarray(h, dtype=float), np.asarray(s, dtype=float), np.asarray(v, dtype=float))
+    sector = np.floor(h * 6.0)
+    f = h * 6.0 - sector
+    p, q, t = v * (1.0 - s), v * (1.0 - s * f), v * (1.0 - s * (1.0 - f))
+    sector = sector.astype(int) % 6
+
+    # The (r, g, b) of each of the six sectors of the hue circle, like colorsys
+    choices = [(v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q)]
+    rgb = [np.choose(sector, [choice[channel] for choice in choices]) for channel in range(3)]
+    rgb = np.stack(rgb, axis=-1)
+    return np.where((s == 0)[..., None], v[..., None], rgb)
+
+class MaterialTable():
+    """The Materials of every node as contiguous float32 columns: ambient, diffuse and specular are n x 3 and
+    shininess is n. Indexing a row returns (or assigns) a Material, so code written against a list of Materials keeps working"""
+
+    def __init__(self, n, ambient = (0.5, 0.5, 0.5), diffuse = (0.5, 0.5, 0.5), specular = (0.5, 0.5, 0.5), shininess = 32):
+        self.ambient = np.empty((n, 3), dtype=np.float32)
+        self.diffuse = np.empty((n, 3), dtype=np.float32)
+        self.specular = np.empty((n, 3), dtype=np.float32)
+        self.shininess = np.empty(n, dtype=np.float32)
+        self.set(ambient, diffuse, specular, shininess)
+
+    @classmethod
+    def from_materials(cls, materials):
+        """Converts a list of Materials"""
+
+        materials = list(materials)
+        return cls(len(materials),
+            [material.ambient for material in materials],
+            [material.diffuse for material in materials],
+            [material.specular for material in materials],
+            [material.shininess for material in materials])
+
+    def set(self, ambient = None, diffuse = None, specular = None, shininess = None, rows = slice(None)):
+        """Overwrites the given columns of rows (all by default) with anything that broadcasts to them"""
+
+        for column, values in ((self.ambient, ambient), (self.diffuse, diffuse), (self.specular, specular), (self.shininess, shininess)):
+            if values is not None:
+                column[rows] = values
+
+    def __len__(self):
+        return len(self.shininess)
+
+    def __getitem__(self, i):
+        return Material(tuple(self.ambient[i]), tuple(self.diffuse[i]), tuple(self.specular[i]), float(self.shininess[i]))
+
+    def __setitem__(self, i, material):
+        self.set(material.ambient, material.diffuse, material.specular, material.shininess, rows=i)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
 class Highlighter():
     def __init__(self, graph):
         self.graph = graph
-        self.layout = self.spring_layout = nx.spring_layout(graph, dim=3, scale=9)
-        self.node_colors=[Material(colorsys.hsv_to_rgb(np.random.rand(), 1, 1), colorsys.hsv_to_rgb(np.random.rand(), 1, 1), (0.5, 0.5, 0.5), 32) for node in graph.nodes()]
-        self.edge_colors=[(0.5, 0.5, 0.5, 0.5) for edge in graph.edges for node in edge]
+        self.set_layout("spring" if graph.number_of_nodes() <= LARGE_GRAPH else "barnes hut", dim=3, scale=9) # Only computed when it is first needed
+        n = graph.number_of_nodes()
+        self.node_colors = MaterialTable(n, hsv_to_rgb(np.random.rand(n), 1, 1), hsv_to_rgb(np.random.rand(n), 1, 1), (0.5, 0.5, 0.5), 32)
+        self.edge_colors = np.full((2 * graph.number_of_edges(), 4), 0.5, dtype=np.float32)
         self.light_color = Material((0.2, 0.2, 0.2), (0.5, 0.5, 0.5), (1.0, 1.0, 1.0), 0)
         self.name=""
         self.node_radius = 0.05
@@ -35,20 +154,82 @@ class Highlighter():
             return name + ", " + degrees
 
         self.text_func = print_name_degree
+        self.node_text = {} # Memoized text_func results, since the focused node's text is asked for every frame
+
+        self.layout_lock = threading.Lock()
+        self.layout_published = False # Whether the animated layout has published positions that the last tick hasn't shown
+        self.changed_node_visibility = None # The nodes whose visibility changed on the last tick, or None for any of them
 
     def tick(self, tick):
-        """ Called every update to handle real time network changes"""
-        pass
+        """ Called every update to handle real time network changes. Returns what changed (NODE_COLORS, EDGE_COLORS, LAYOUT)"""
+        return self.show_published_layout()
+
+    def animate_layout(self, iterations = 50, seed = LAYOUT_SEED, **params):
+        """Lays the graph out with the Barnes-Hut layout (see layouts.iter_barnes_hut_layout and its parameters) in a
+        background thread, so the window opens right away and the layout settles on screen. The worker publishes
+        every iteration to a back buffer, and each tick copies the latest one into the front buffer the layout reads
+        from. A layout that was already computed is shown at once instead"""
+
+        params = dict(params, iterations=iterations)
+        params.setdefault("dim", 3)
+        params.setdefault("scale", 9)
+        key = layout_key(self.graph, "barnes hut", seed, params)
+        self.set_layout("barnes hut", seed, **params)
+        if find_shared_layout(self.graph, key) is not None:
+            return
+
+        n, dim = self.graph.number_of_nodes(), params["dim"]
+        self.front_positions = np.zeros((n, dim), dtype=np.float32)
+        self.back_positions = np.zeros((n, dim), dtype=np.float32)
+        self.layout = dict(zip(self.graph.nodes, self.front_positions)) # Views into the front buffer
+        self._positions = self.front_positions if dim == 3 else None # Kept current in place by show_published_layout
+
+        def work():
+            positions = self.front_positions
+            for positions in layouts.iter_barnes_hut_layout(self.graph, seed=seed, **params):
+                with self.layout_lock:
+                    self.back_positions[:] = positions
+                    self.layout_published = True
+            store_shared_layout(self.graph, key, positions)
+
+        # Daemon so a layout that is still running doesn't keep the program open after the window closes
+        self.layout_worker = threading.Thread(target=work, daemon=True)
+        self.layout_worker.start()
 
-    def set_node_colors(self, node_colors):
-        """Accepts an array of Materials that correspond to the colors of each node in the network"""
+    def show_published_layout(self):
+        """Copies the latest positions the animated layout published into the front buffer. Returns (LAYOUT,) if there were any"""
 
-        self.node_colors = node_colors
+        with self.layout_lock:
+            if not self.layout_published:
+                return ()
+            self.front_positions[:] = self.back_positions
+            self.layout_published = False
+        return (LAYOUT,)
 
-    def set_edge_colors(self, edge_colors):
-        """Accepts an array of tuples of four values which correspond to the colors from one node to the next node"""
+    def set_node_colors(self, node_colors, values = None):
+        """Accepts a MaterialTable or a list of Materials that correspond to the colors of each node in the network.
+        An n x 3 array of rgb colors sets the ambient and diffuse colors of the current materials, and a colormap
+        (a function from an array to an array of rgb colors) does the same with the colors it gives values"""
 
-        self.edge_colors = edge_colors
+        if callable(node_colors):
+            node_colors = node_colors(np.asarray(values))
+
+        if isinstance(node_colors, MaterialTable):
+            self.node_colors = node_colors
+        elif isinstance(node_colors, np.ndarray):
+            self.node_colors.set(ambient=node_colors, diffuse=node_colors)
+        else:
+            self.node_colors = MaterialTable.from_materials(node_colors)
+
+    def set_edge_colors(self, edge_colors, values = None):
+        """Accepts rgba colors that broadcast to a (2 * edges) x 4 array, which are the colors from one node to the
+        next node of every edge (a list of tuples, or a single color for all of them). A colormap (a function from an
+        array to an array of rgba colors) gives the colors of values"""
+
+        if callable(edge_colors):
+            edge_colors = edge_colors(np.asarray(values))
+
+        self.edge_colors = np.array(np.broadcast_to(np.asarray(edge_colors, dtype=np.float32), (2 * self.graph.number_of_edges(), 4)))
 
     def get_node_colors(self):
         return self.node_colors
@@ -59,15 +240,66 @@ class Highlighter():
     def get_edges(self):
         return self.graph.edges()
 
+    def get_edge_endpoints(self):
+        """The position (in graph.nodes order) of both nodes of every edge, in the order of the edge colors"""
+
+        if not hasattr(self, "edge_endpoints"):
+            index = {node : i for i, node in enumerate(self.graph.nodes)}
+            self.edge_endpoints = np.array([index[node] for edge in self.graph.edges for node in edge], dtype=int)
+
+        return self.edge_endpoints
+
+    def get_node_visibility(self):
+        """A boolean array of which nodes (in graph.nodes order) are shown, or None if all of them are"""
+
+        return None
+
     def get_node_radius(self):
         return self.node_radius
 
     def set_node_radius(self, radius):
         self.node_radius = radius
 
+    def set_layout(self, algorithm, seed = LAYOUT_SEED, **params):
+        """Lays the graph out with one of LAYOUTS and its parameters when the layout is first needed, sharing the
+        positions with every other highlighter of the same graph and layout (see get_shared_layout)"""
+
+        self.layout_algorithm = algorithm
+        self.layout_seed = seed
+        self.layout_params = params
+        self._layout = None
+        self._positions = None
+
+    @property
+    def layout(self):
+        if self._layout is None:
+            self._layout = get_shared_layout(self.graph, self.layout_algorithm, self.layout_seed, **self.layout_params)
+            self._positions = None
+        return self._layout
+
+    @layout.setter
+    def layout(self, layout):
+        """Accepts a dictionary from each node to its position, used in place of the set layout algorithm"""
+
+        self._layout = layout
+        self._positions = None
+
+    @property
+    def spring_layout(self):
+        return get_shared_layout(self.graph, "spring", dim=3, scale=9)
+
     def get_layout(self):
         return self.layout
 
+    def get_positions(self):
+        """The positions of the layout as an n x 3 float32 array in graph.nodes order, built once per layout and
+        shared with every caller, so it must not be modified"""
+
+        layout = self.layout
+        if self._positions is None:
+            self._positions = np.array([layout[node] for node in self.graph.nodes], dtype=np.float32).reshape(-1, 3)
+        return self._positions
+
     def get_light_color(self):
         return self.light_color
 
@@ -77,11 +309,11 @@ class Highlighter():
         self.light_color = light_color
 
     def get_edge_strengths(self):
+        """1 for every edge that is reciprocated (every edge of an undirected graph) and 0 otherwise, which the
+        line shader draws as flow stripes"""
+
         if not hasattr(self, "edge_strengths"):
-            if nx.is_directed(self.graph):
-                self.edge_strengths = [1 if self.graph.has_edge(edge[1], edge[0]) else 0 for edge in self.graph.edges()]
-            else:
-                self.edge_strengths = [1 for edge in self.graph.edges()]
+            self.edge_strengths = attributes.directed_structure(self.graph).reciprocal.astype(np.float32)
 
         return self.edge_strengths
 
@@ -89,9 +321,12 @@ class Highlighter():
         """Accepts a function that takes in the node number, and return a string that is the node description"""
 
         self.text_func = text_func
+        self.node_text = {}
 
     def print_node(self, focused_node):
-        return self.text_func(focused_node)
+        if focused_node not in self.node_text:
+            self.node_text[focused_node] = self.text_func(focused_node)
+        return self.node_text[focused_node]
 
 class LightHighlighter(Highlighter):
     def __init__(self):
@@ -100,7 +335,169 @@ class LightHighlighter(Highlighter):
         self.light_material = Material((1.1, 1.1, 1.1), (1, 1, 1), (1, 1, 1), 1)
 
     def get_node_colors(self):
-        return [self.light_material]
+        return MaterialTable.from_materials([self.light_material])
 
     def get_light_color(self):
-        return self.light_material
\ No newline at end of file
+        return self.light_material
+class StreamHighlighter(Highlighter):
+    """Consumes a stream of snapshots (like partition.iter_partition) in a background thread, and recolors
+    the network from the latest snapshot on the next tick with recolor(highlighter, snapshot)"""
+
+    def __init__(self, graph, snapshots, recolor):
+        super().__init__(graph)
+        self.recolor = recolor
+        self.latest = None
+        self.lock = threading.Lock()
+
+        # Daemon so a stream that is still running doesn't keep the program open after the window closes
+        self.worker = threading.Thread(target=self.consume, args=(snapshots,), daemon=True)
+        self.worker.start()
+
+    def consume(self, snapshots):
+        for snapshot in snapshots:
+            with self.lock:
+                self.latest = snapshot
+
+    def tick(self, tick):
+        changes = super().tick(tick)
+        with self.lock:
+            snapshot, self.latest = self.latest, None
+
+        if snapshot is None:
+            return changes
+
+        self.recolor(self, snapshot)
+        return changes + (NODE_COLORS, EDGE_COLORS)
+
+class TemporalHighlighter(Highlighter):
+    """Plays back a stream of edges (like datasets.load_edge_stream) at rate edges per second. An edge is shown from
+    when it arrives until window more edges have arrived without it arriving again (or forever if window is None), and
+    a node is shown while it has an edge. Edges live in fixed slots of the edge buffers: a removed edge frees its slot
+    (drawn as an invisible point) for the next added edge, so a tick only rewrites the slots that changed"""
+
+    def __init__(self, graph, stream, name = "", rate = 50, window = 200, loop = True, capacity = 64):
+        super().__init__(graph)
+        self.stream = np.asarray(stream)
+        self.stream_name = self.name = name
+        self.rate = rate
+        self.window = window
+        self.loop = loop
+        self.color = np.array((0.8, 0.8, 0.8, 0.5), dtype=np.float32)
+
+        self.slot_edges = np.zeros((0, 2), dtype=int)
+        self.edge_colors = np.zeros((0, 4), dtype=np.float32)
+        self.free_slots = []
+        self.allocate(capacity)
+        self.restart()
+
+        # The degree of a node among the edges shown right now, not over the whole stream
+        def print_shown_degree(focused_node):
+            return "Node: {}, Degree: {}".format(focused_node, self.degrees[focused_node])
+
+        self.text_func = print_shown_degree
+
+    def allocate(self, capacity):
+        """Grows the slots to capacity, keeping the edges in the slots they are in"""
+
+        old = len(self.slot_edges)
+        self.slot_edges = np.concatenate((self.slot_edges, np.zeros((capacity - old, 2), dtype=int)))
+        self.edge_colors = np.concatenate((self.edge_colors, np.zeros((2 * (capacity - old), 4), dtype=np.float32)))
+        self.edge_strengths = np.ones(capacity)
+        self.free_slots = list(range(capacity - 1, old - 1, -1)) + self.free_slots # Lowest slots are reused first
+
+    def restart(self):
+        self.slots = {} # The slot of every edge that is shown
+        self.expiry = {} # The position in the stream where every edge that is shown stops being shown
+        self.expiring = [] # A heap of (expiry, edge), where entries of edges that arrived again are skipped when popped
+        self.degrees = np.zeros(self.graph.number_of_nodes(), dtype=int)
+        self.node_text = {}
+        self.free_slots = list(range(len(self.slot_edges) - 1, -1, -1))
+        self.slot_edges[:] = 0
+        self.edge_colors[:] = 0
+        self.changed_edge_slots = np.zeros(0, dtype=int)
+        self.position = 0 # How much of the stream has arrived
+        self.start_tick = None
+
+    def get_edge_endpoints(self):
+        return self.slot_edges.ravel()
+
+    def get_edge_strengths(self):
+        return self.edge_strengths
+
+    def get_node_visibility(self):
+        return self.degrees > 0
+
+    def add_edge(self, edge, changed_slots, changed_nodes, toggled_nodes):
+        slot = self.free_slots.pop()
+        self.slots[edge] = slot
+        self.slot_edges[slot] = edge
+        self.edge_colors[2 * slot:2 * slot + 2] = self.color
+        for node in set(edge):
+            if self.degrees[node] == 0:
+                toggled_nodes.append(node) # It gets shown
+            self.degrees[node] += 1
+        changed_slots.append(slot)
+        changed_nodes.extend(edge)
+
+    def remove_edge(self, edge, changed_slots, changed_nodes, toggled_nodes):
+        slot = self.slots.pop(edge)
+        self.free_slots.append(slot)
+        self.slot_edges[slot] = 0
+        self.edge_colors[2 * slot:2 * slot + 2] = 0
+        for node in set(edge):
+            self.degrees[node] -= 1
+            if self.degrees[node] == 0:
+                toggled_nodes.append(node) # It gets hidden
+        changed_slots.append(slot)
+        changed_nodes.extend(edge)
+
+    def tick(self, tick):
+        changes = super().tick(tick)
+        if self.start_tick is None:
+            self.start_tick = tick
+        target = min(int((tick - self.start_tick) * self.rate / 1000), len(self.stream))
+
+        changed_slots, changed_nodes, toggled_nodes = [], [], []
+        rebuild = False
+
+        # Start over once the whole stream has been shown
+        if self.loop and self.position == len(self.stream) and target == len(self.stream):
+            for edge in list(self.slots):
+                self.remove_edge(edge, changed_slots, changed_nodes, toggled_nodes)
+            self.expiry, self.expiring = {}, []
+            self.position, self.start_tick, target = 0, tick, 0
+
+        for u, v in self.stream[self.position:target].tolist():
+            edge = (min(u, v), max(u, v))
+            self.position += 1
+            if edge not in self.slots:
+                if not self.free_slots:
+                    self.allocate(2 * len(self.slot_edges))
+                    rebuild = True
+                self.add_edge(edge, changed_slots, changed_nodes, toggled_nodes)
+            if self.window is not None:
+                self.expiry[edge] = self.position + self.window
+                heapq.heappush(self.expiring, (self.expiry[edge], edge))
+
+        while self.expiring and self.expiring[0][0] <= self.position:
+            expiry, edge = heapq.heappop(self.expiring)
+            if self.expiry.get(edge) == expiry:
+                del self.expiry[edge]
+                self.remove_edge(edge, changed_slots, changed_nodes, toggled_nodes)
+
+        for node in changed_nodes:
+            self.node_text.pop(node, None) # The degree in the text changed
+        self.changed_edge_slots = np.unique(np.array(changed_slots, dtype=int))
+        self.name = "{}, Edges: {} / {}, Shown: {}".format(self.stream_name, self.position, len(self.stream), len(self.slots))
+
+        # A node shown and hidden again (or the other way around) within the tick didn't change
+        nodes, toggles = np.unique(np.array(toggled_nodes, dtype=int), return_counts=True)
+        self.changed_node_visibility = nodes[toggles % 2 == 1]
+        if len(self.changed_node_visibility):
+            changes += (NODE_VISIBILITY,)
+
+        if rebuild:
+            return changes + (EDGES,)
+        if changed_slots:
+            return changes + (EDGE_SLOTS,)
+        return changes
@@ -0,0 +1,98 @@
+import json
+import os
+import time
+
+# Optional instrumentation for the partition optimizer. Pass a PartitionTrace as trace= to the partition functions
+# (get_partition, refine_partition, refine_local, get_partition_runs with processes=1, get_partition_multilevel) to
+# record what each phase did. get_partition and refine_partition record "partition" runs of full phases that may move
+# every node; get_partition_multilevel refines its levels with refine_local, which records "local" runs with one phase
+# per sweep of batched moves. When no trace is passed the optimizer only skips a few `if trace is not None` checks.
+
+# Why a run of the optimizer stopped
+STALLED = "stalled" # a phase found nothing better than the phase before it
+PHASE_LIMIT = "phase limit" # it ran the maximum number of phases (T in partition.partition_moves, sweeps in partition.refine_local)
+STOPPED = "stopped" # its stop event was set (another trial of partition.get_partition_runs reached the target)
+
+class PartitionTrace():
+    """Records the per phase wall time, candidate moves scored, and time spent scoring moves (evaluating
+    likelihoods) versus bookkeeping for every run of the optimizer, along with why each run stopped"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.runs = [] # (name, convergence reason) for every run
+        self.phases = [] # one dictionary per finished phase
+        self.current = None
+
+    def begin_run(self, name):
+        self.runs.append([name, None])
+
+    def converged(self, reason):
+        self.runs[-1][1] = reason
+
+    def begin_phase(self, phase):
+        self.current = {"run" : len(self.runs) - 1, "phase" : phase, "start" : time.perf_counter(),
+                        "steps" : 0, "moves" : 0, "scoring" : 0.0}
+
+    def scored(self, moves, seconds):
+        """Records one step of the phase that scored moves candidate moves in seconds"""
+
+        self.current["steps"] += 1
+        self.current["moves"] += moves
+        self.current["scoring"] += seconds
+
+    def end_phase(self, logL):
+        self.current["end"] = time.perf_counter()
+        self.current["logL"] = logL
+        self.phases.append(self.current)
+        self.current = None
+
+    def wall_time(self, phase):
+        return phase["end"] - phase["start"]
+
+    def moves_scored(self):
+        return sum(phase["moves"] for phase in self.phases)
+
+    def scoring_time(self):
+        return sum(phase["scoring"] for phase in self.phases)
+
+    def bookkeeping_time(self):
+        return sum(self.wall_time(phase) - phase["scoring"] for phase in self.phases)
+
+    def summary(self):
+        """Formats a table of the phases followed by the totals as a string"""
+
+        lines = ["{:<24} {:>6} {:>6} {:>10} {:>10} {:>12} {:>14}".format("run", "phase", "steps", "time (s)", "scoring", "moves", "log-likelihood")]
+        for phase in self.phases:
+            lines.append("{:<24} {:>6} {:>6} {:>10.4f} {:>10.4f} {:>12} {:>14.2f}".format(
+                self.runs[phase["run"]][0], phase["phase"], phase["steps"], self.wall_time(phase), phase["scoring"], phase["moves"], phase["logL"]))
+        for name, reason in self.runs:
+            lines.append("{}: {}".format(name, reason))
+        lines.append("Moves scored: {}, scoring: {:.4f}s, bookkeeping: {:.4f}s".format(self.moves_scored(), self.scoring_time(), self.bookkeeping_time()))
+        return "\n".join(lines)
+
+    def to_chrome_trace(self):
+        """Returns the trace in the Chrome trace event format (for chrome://tracing or Perfetto), one row per run"""
+
+        micros = lambda seconds : (seconds - self.origin) * 1e6
+        events = []
+        for phase in self.phases:
+            row = {"pid" : os.getpid(), "tid" : phase["run"]}
+            events.append(dict(row, name="phase {}".format(phase["phase"]), ph="X", ts=micros(phase["start"]),
+                               dur=(phase["end"] - phase["start"]) * 1e6, args={
+                                   "steps" : phase["steps"], "moves scored" : phase["moves"],
+                                   "scoring (s)" : phase["scoring"], "log-likelihood" : phase["logL"]}))
+            events.append(dict(row, name="log-likelihood", ph="C", ts=micros(phase["end"]), args={"logL" : phase["logL"]}))
+
+        for run, (name, reason) in enumerate(self.runs):
+            events.append({"pid" : os.getpid(), "tid" : run, "name" : "thread_name", "ph" : "M", "args" : {"name" : name}})
+            ends = [phase["end"] for phase in self.phases if phase["run"] == run]
+            if reason is not None and ends:
+                events.append({"pid" : os.getpid(), "tid" : run, "name" : reason, "ph" : "i", "s" : "t", "ts" : micros(max(ends))})
+
+        return {"traceEvents" : events, "displayTimeUnit" : "ms"}
+
+    def export(self, path):
+        """Writes the Chrome trace event JSON to path"""
+
+        with open(path, "w") as file:
+            json.dump(self.to_chrome_trace(), file)
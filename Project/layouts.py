@@ -0,0 +1,159 @@
+import numpy as np
+import networkx as nx
+import partition
+
+# Force directed layouts in NumPy for graphs too large for nx.spring_layout. Uses the same Fruchterman-Reingold
+# model (attraction d^2 / k along edges, repulsion k^2 / d between all nodes, every node moving a cooling distance
+# t along its net force each iteration), but approximates the repulsion with a Barnes-Hut tree over Morton codes,
+# O(n log n) per iteration instead of O(n^2), and lays the graph out coarse to fine with partition.coarsen.
+
+DEPTH = 10 # Levels of the Barnes-Hut tree below the root, so each axis is quantized into 2^DEPTH cells
+
+class BarnesHutTree():
+    # A 2^dim-ary tree (an octree in 3D) over weighted points, built level by level from their Morton codes.
+    # The cells of every level are the distinct codes shifted right by dim bits per level below it, kept sorted,
+    # so the children of a cell are a contiguous run of the cells of the next level.
+    def __init__(self, positions, masses, depth = DEPTH):
+        n, self.dim = positions.shape
+        self.depth = depth
+        self.origin = positions.min(axis=0)
+        self.size = max(float((positions.max(axis=0) - self.origin).max()), 1e-9) * (1 + 1e-6)
+
+        cells = np.minimum(((positions - self.origin) / self.size * 2**depth).astype(np.int64), 2**depth - 1)
+        self.codes = np.zeros(n, dtype=np.int64)
+        for bit in range(depth):
+            for axis in range(self.dim):
+                self.codes |= ((cells[:, axis] >> bit) & 1) << (bit * self.dim + axis)
+
+        self.ids, self.mass, self.center = [], [], []
+        for level in range(depth + 1):
+            ids, inverse = np.unique(self.codes >> (self.dim * (depth - level)), return_inverse=True)
+            mass = np.bincount(inverse, masses, minlength=len(ids))
+            center = np.stack([np.bincount(inverse, masses * positions[:, axis], minlength=len(ids)) for axis in range(self.dim)], axis=1) / mass[:, None]
+            self.ids.append(ids)
+            self.mass.append(mass)
+            self.center.append(center)
+
+        # The first and one past the last child of every cell
+        self.children = [(np.searchsorted(self.ids[level + 1], self.ids[level] << self.dim),
+                          np.searchsorted(self.ids[level + 1], (self.ids[level] + 1) << self.dim)) for level in range(depth)]
+
+    def repulsion(self, positions, masses, k, theta = 0.8):
+        # Returns the repulsive displacement k^2 m_j delta / d^2 on every point from all of the others, where a cell
+        # whose width is under theta times its distance to the point stands in for all of the points in it
+        n = len(positions)
+        force = np.zeros_like(positions)
+        points, cells = np.arange(n), np.zeros(n, dtype=np.int64)
+
+        for level in range(self.depth + 1):
+            mass = self.mass[level][cells]
+            center = self.center[level][cells]
+            contains = (self.codes[points] >> (self.dim * (self.depth - level))) == self.ids[level][cells]
+
+            if level == self.depth:
+                # The leaves are points (or points that fell in the same cell), so take the point itself out
+                own = masses[points]
+                remaining = mass - np.where(contains, own, 0)
+                center = np.where(contains[:, None], (center * mass[:, None] - positions[points] * own[:, None]) / np.maximum(remaining, 1e-12)[:, None], center)
+                mass = remaining
+                accept = mass > 1e-12
+            else:
+                distance = np.linalg.norm(positions[points] - center, axis=1)
+                accept = ~contains & (self.size / 2**level < theta * distance)
+
+            delta = positions[points[accept]] - center[accept]
+            distance = np.maximum(np.linalg.norm(delta, axis=1), 0.01)
+            push = delta * (k * k * mass[accept] / distance**2)[:, None]
+            for axis in range(self.dim):
+                force[:, axis] += np.bincount(points[accept], push[:, axis], minlength=n)
+
+            if level == self.depth:
+                break
+
+            # Open every other cell into its children
+            points, cells = points[~accept], cells[~accept]
+            first, last = self.children[level][0][cells], self.children[level][1][cells]
+            counts = last - first
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            points, cells = np.repeat(points, counts), np.repeat(first, counts) + offsets
+
+        return force
+
+def iter_fruchterman_reingold(adj, positions, masses, k, iterations, temperature, theta = 0.8):
+    # Runs iterations of the Fruchterman-Reingold model from positions, cooling linearly from temperature, and
+    # yields the positions after every iteration
+    #
+    # input  : adj, a sparse symmetric matrix of edge weights; masses, how many nodes every node stands for
+    adj = adj.tocoo()
+    rows, cols, weights = adj.row, adj.col, adj.data
+    off_diagonal = rows != cols
+    rows, cols, weights = rows[off_diagonal], cols[off_diagonal], weights[off_diagonal]
+    n, dim = positions.shape
+    cooling = temperature / (iterations + 1)
+
+    for iteration in range(iterations):
+        force = BarnesHutTree(positions, masses).repulsion(positions, masses, k, theta)
+
+        delta = positions[rows] - positions[cols]
+        distance = np.linalg.norm(delta, axis=1)
+        pull = delta * (weights * distance / k)[:, None]
+        for axis in range(dim):
+            force[:, axis] -= np.bincount(rows, pull[:, axis], minlength=n)
+
+        length = np.maximum(np.linalg.norm(force, axis=1), 0.01)
+        positions = positions + force * (temperature / length)[:, None]
+        temperature -= cooling
+        yield positions
+
+def fruchterman_reingold(adj, positions, masses, k, iterations, temperature, theta = 0.8):
+    # Returns the positions after all of the iterations (see iter_fruchterman_reingold)
+    for positions in iter_fruchterman_reingold(adj, positions, masses, k, iterations, temperature, theta):
+        pass
+    return positions
+
+def iter_barnes_hut_layout(G, dim = 3, scale = 1, seed = None, iterations = 50, theta = 0.8, coarse_size = 50):
+    # Lays G out like barnes_hut_layout, yielding the n x dim positions of every node (in G.nodes order, centered and
+    # scaled) after every iteration at every level, so the layout can be shown while it settles. While coarser
+    # levels are laid out every node is shown at its coarse node.
+    rng = np.random.default_rng(seed)
+    n = G.order()
+    if n <= 1:
+        yield np.zeros((n, dim))
+        return
+
+    levels = [] # (graph, groups, the node of graph every node of G is in) from the finest level to the coarsest
+    coarse = partition.graph_arrays(G)
+    masses = [np.ones(coarse.n)]
+    to_coarse = np.arange(n) # The node every node of G is merged into at the coarsest level so far
+    while coarse.n > coarse_size:
+        groups, coarser = partition.coarsen(coarse, rng)
+        if coarser.n > 0.9*coarse.n:
+            break # The matching stalled around hubs, so further levels would barely shrink the graph
+        levels.append((coarse, groups, to_coarse))
+        masses.append(np.bincount(groups, masses[-1]))
+        to_coarse = groups[to_coarse]
+        coarse = coarser
+
+    # Every level lays out the same total mass in the unit box, so they all share the natural spring length of the finest
+    k = np.sqrt(1 / n)
+    positions = rng.random((coarse.n, dim))
+    for positions in iter_fruchterman_reingold(coarse.adj, positions, masses.pop(), k, iterations, 0.1, theta):
+        yield nx.rescale_layout(positions[to_coarse], scale=scale)
+
+    for graph, groups, to_coarse in reversed(levels):
+        positions = positions[groups] + rng.normal(scale=k * 0.1, size=(graph.n, dim))
+        for positions in iter_fruchterman_reingold(graph.adj, positions, masses.pop(), k, max(iterations // 4, 1), 0.1 * 0.25, theta):
+            yield nx.rescale_layout(positions[to_coarse], scale=scale)
+
+def barnes_hut_layout(G, dim = 3, scale = 1, seed = None, iterations = 50, theta = 0.8, coarse_size = 50):
+    # A drop in replacement for nx.spring_layout (see highlighters.LAYOUTS). Coarsens G with heavy edge matching until
+    # it has at most coarse_size nodes, lays the coarsest graph out with all of the iterations, then places every
+    # node at its coarse node (plus a little noise) and refines each finer level with a quarter of the iterations
+    # at a lower temperature.
+    #
+    # input  : G a graph whose nodes are labeled 0 to n-1; dim, scale and seed as in nx.spring_layout
+    #        : theta, the Barnes-Hut opening criterion (0 is exact); coarse_size, where coarsening stops
+    # output : a dictionary from every node to its position, centered and scaled like nx.spring_layout
+    for positions in iter_barnes_hut_layout(G, dim, scale, seed, iterations, theta, coarse_size):
+        pass
+    return dict(zip(G.nodes, positions))
@@ -2,10 +2,12 @@ import importlib
 import visualizer as vs
 import networkx as nx
 import highlighters as hl
-import colorsys
 import partition
-from pathlib import Path
-import functools
+from datasets import load_network, load_neural, load_edge_stream
+import cache
+import attributes
+import motifs
+import null_models
 import random as rand
 import numpy as np
 
@@ -18,77 +20,74 @@ def neighbors_highlighter(G):
 
     highlighter.set_node_text(on_node_selection)
 
-    def color(node):
-        return (0.5, 0.5, 0.5)
+    node_colors = hl.MaterialTable(G.number_of_nodes(), (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), 32)
 
-    node_colors = [hl.Material(
-        color(node), 
-        color(node),
-        color(node), 
-        32) for node in G.nodes]
-    
-    edge_colors = [(0.8, 0.8, 0.8, 0.05) for edge in G.edges for node in edge]
     highlighter.set_node_colors(node_colors)
-    highlighter.set_edge_colors(edge_colors)
+    highlighter.set_edge_colors((0.8, 0.8, 0.8, 0.05))
     return highlighter
 
 def text_highlighter(G):
     highlighter = hl.Highlighter(G)
     highlighter.set_node_radius(0.01)
 
-    if nx.is_directed(G):
-        reciprocities = list(nx.algorithms.reciprocity(G, nodes=G.nodes).values())
+    # Computed once for every node, so hovering over a node only formats its text
+    node_attributes = attributes.NodeAttributes(G)
 
     def display_node_attributes(node):
-        """Accepts a node, calculates various attributes, and formats it into a string"""
+        """Accepts a node, looks up its attributes, and formats them into a string"""
 
+        values = node_attributes[node]
         text = G[node]["name"] if hasattr(G[node], "name") else "Node: " + str(node)
 
         if nx.is_directed(G):
-            text += ", In Degree: " + str(G.in_degree[node])
-            text += ", Out Degree: " + str(G.out_degree[node])
+            text += ", In Degree: " + str(values["in_degree"])
+            text += ", Out Degree: " + str(values["out_degree"])
         else:
-            text += "Degree: " + str(G.degree[node])
+            text += ", Degree: " + str(values["degree"])
 
-        eccentricity = max(nx.single_source_shortest_path_length(G, node))
-        text += ", Ecentricity: " + str(eccentricity)
+        text += ", Ecentricity: " + str(values["eccentricity"])
 
         if nx.is_directed(G):
-            text += ", Reciprocity: {:.2f}".format(reciprocities[node])
+            text += ", Reciprocity: {:.2f}".format(values["reciprocity"])
 
         return text
     highlighter.set_node_text(display_node_attributes)
 
-    degrees = [degree for node, degree in G.in_degree]
+    degrees = np.array([degree for node, degree in G.in_degree])
     median_degree = np.median(degrees)
-    def color(degree):
-        return (0.5, 0.5, 1) if degree < (median_degree * 9) else (15, 10, 10)
-    node_colors = [hl.Material(
-            color(degree), 
-            color(degree),
-            color(degree), 
-            32) for degree in degrees]
-
-    edge_colors = [(0.8, 0.8, 0.8, 0.05) for edge in G.edges for node in edge]
+    colors = np.where((degrees < (median_degree * 9))[:, None], (0.5, 0.5, 1), (15, 10, 10))
+    node_colors = hl.MaterialTable(len(degrees), colors, colors, colors, 32)
+
     highlighter.set_node_colors(node_colors)
-    highlighter.set_edge_colors(edge_colors)
+    highlighter.set_edge_colors((0.8, 0.8, 0.8, 0.05))
+    return highlighter
+
+# Opens right away and lets the layout settle on screen, for graphs that take a while to lay out
+def animated_layout_highlighter(G, name):
+    highlighter = text_highlighter(G)
+    highlighter.name = name
+    highlighter.animate_layout()
+    return highlighter
+
+# Plays back an edge list one edge at a time, in the order of its lines
+def temporal_highlighter(filename, name, rate = 50, window = 200):
+    G, stream = load_edge_stream(filename)
+    highlighter = hl.TemporalHighlighter(G, stream, name, rate = rate, window = window)
+    highlighter.set_node_radius(0.03)
     return highlighter
 
 def degree_vibrance_highlighter(G, use_hue=False):
     """Sets node colors and edges to be brighter the higher degree they have. Singletons are black."""
 
     highlighter = hl.Highlighter(G)
-    highlighter.layout = nx.spring_layout(G, dim=3, scale=1000)
-    degrees = [degree for node, degree in G.degree]
+    highlighter.set_layout("spring", dim=3, scale=1000)
+    degrees = np.array([G.degree[node] for node in G.nodes]) # by position in G.nodes, like the colors
     max_degree = 1 / max(degrees)
-    hue = lambda degree : (degree * max_degree) * 0.7 # Make it less than 1 so we don't get red values for max and min
-    node_colors = [hl.Material(
-            colorsys.hsv_to_rgb(hue(degree) if use_hue else 0, 1, 1), 
-            colorsys.hsv_to_rgb(hue(degree) if use_hue else 0, 1, 1),
-            colorsys.hsv_to_rgb(0, 0.0, 1), 
-            1) for degree in degrees]
+    hue = (degrees * max_degree) * 0.7 if use_hue else 0 # Make it less than 1 so we don't get red values for max and min
+    colors = hl.hsv_to_rgb(hue, 1, np.ones(len(degrees)))
+    node_colors = hl.MaterialTable(len(degrees), colors, colors, hl.hsv_to_rgb(0, 0.0, 1), 1)
 
-    edge_colors = [(*node_colors[node].ambient, 0.5) for edge in G.edges for node in edge]
+    edge_colors = np.column_stack((colors[highlighter.get_edge_endpoints()], np.full(2 * G.number_of_edges(), 0.5)))
 
     node_colors[139] = hl.Material(
             (0.5, 1, 1), 
@@ -106,135 +105,188 @@ def triangle_highlighter(G, name, feed_back_loop=False):
     highlighter = hl.Highlighter(G)
     highlighter.name = name
     degrees = [degree for node, degree in G.degree]
-    normal_material = hl.Material(colorsys.hsv_to_rgb(0,0.5,0.5), colorsys.hsv_to_rgb(0,0.5,0.5), (0.5, 0.5, 0.5), 32)
-    triangle_material = hl.Material(colorsys.hsv_to_rgb(0.5,0.5,1), colorsys.hsv_to_rgb(0.5,0.5,1), (0.5, 0.5, 0.5), 32)
-    normal_edge_color = (*normal_material.ambient, 0.5)
-    triangle_edge_color = (*colorsys.hsv_to_rgb(0.5,0.5,2), 0.5)
-
-    # Find all nodes that are part of a triangle
-    def find_triangles():
-        triangle_nodes = set()
-        triangle_edges = set()
-        for node in G:
-            for neighbor in G.neighbors(node):
-                for second_neighbor in G.neighbors(neighbor):
-                    if neighbor != second_neighbor and G.has_edge(second_neighbor, node):
-                        triangle_nodes.update((node, neighbor, second_neighbor))
-                        triangle_edges.update(((node, neighbor), (neighbor, second_neighbor), (second_neighbor, node), (neighbor, node), (second_neighbor, neighbor), (node, second_neighbor)))
-        return triangle_nodes, triangle_edges
-
-    def find_feed_back_loop():
-        triangle_nodes = set()
-        triangle_edges = set()
-        for node in G:
-            for neighbor in G.neighbors(node):
-                for second_neighbor in G.neighbors(neighbor):
-                    if neighbor != second_neighbor and node in G.neighbors(second_neighbor):
-                        triangle_nodes.update((node, neighbor, second_neighbor))
-                        triangle_edges.update(((node, second_neighbor), (node, neighbor), (neighbor, second_neighbor)))
-        return triangle_nodes, triangle_edges
-
-    triangle_nodes, triangle_edges = find_feed_back_loop() if feed_back_loop else find_triangles()
-    node_colors = [triangle_material if node in triangle_nodes else normal_material for node in G.nodes]
-
-    # Edges that are a part of a triangle are highlighted with a special color
-    edge_colors = [triangle_edge_color if edge in triangle_edges else normal_edge_color for edge in G.edges for node in edge]
+    normal_color = hl.hsv_to_rgb(0,0.5,0.5)
+    triangle_color = hl.hsv_to_rgb(0.5,0.5,1)
+    normal_edge_color = (*normal_color, 0.5)
+    triangle_edge_color = (*hl.hsv_to_rgb(0.5,0.5,2), 0.5)
+
+    # Boolean masks of the nodes and edges that are part of a triangle (or feed back loop), aligned with G.nodes and G.edges
+    triangle_nodes, triangle_edges = motifs.feed_back_loop_masks(G) if feed_back_loop else motifs.triangle_masks(G)
+    colors = np.where(triangle_nodes[:, None], triangle_color, normal_color)
+    node_colors = hl.MaterialTable(len(colors), colors, colors, (0.5, 0.5, 0.5), 32)
+
+    # Edges that are a part of a triangle are highlighted with a special color, at both of their ends
+    edge_colors = np.where(np.repeat(triangle_edges, 2)[:, None], triangle_edge_color, normal_edge_color)
 
     highlighter.set_node_colors(node_colors)
     highlighter.set_edge_colors(edge_colors)
     return highlighter
 
-# Get the partition either from a cache or generate it using the likelihood algorithm
-def get_partition(G, partition_filename, c = 2):
-    path = Path(__file__).parent / "./data/" / partition_filename
-    try:
-        with path.open() as file:
-            z = [int(i) for i in file.read().split(" ")]
-    except:
-        z = partition.get_partition_n(G, c = c, trials = 5)
-        path.touch()
-        path.write_text(functools.reduce(lambda acc, x: str(acc) + " " + str(x), z)) # Save to cache
+# Colors nodes and edges by how many of one motif (see motifs.MOTIFS, like "030C" or "4-cycle") they are in,
+# from dim red for none to bright blue for the most
+def motif_highlighter(G, name, motif_id):
+    totals, node_counts, edge_counts = motifs.motif_census(G)
+    highlighter = hl.Highlighter(G)
+    highlighter.name = "{}, {}: {}".format(name, motif_id, totals[motif_id])
+
+    # A colormap from counts to rgb colors
+    def color(counts):
+        share = counts / counts.max() if len(counts) and counts.max() > 0 else np.zeros(len(counts))
+        return hl.hsv_to_rgb(share * 0.6, 0.5 + 0.5 * share, 0.4 + 0.6 * share) # Less than 1 so the max isn't red again
+
+    highlighter.set_node_colors(color, node_counts[motif_id])
+    highlighter.node_colors.set(specular=(0.5, 0.5, 0.5), shininess=32)
+    highlighter.set_edge_colors(lambda counts : np.column_stack((color(counts), np.full(len(counts), 0.5))), np.repeat(edge_counts[motif_id], 2))
+    highlighter.set_node_text(lambda node : "Node: {}, {} motifs: {}".format(node, motif_id, node_counts[motif_id][node]))
+    return highlighter
+
+# Highlights the motif that is the most over represented compared to degree preserving randomizations of the network
+def significance_highlighter(G, name, model = "edge swap", samples = 100):
+    significance = null_models.motif_significance(G, model, samples)
+    motif_id = max(significance, key=lambda motif : significance[motif][1])
+    count, z, p = significance[motif_id]
+
+    highlighter = motif_highlighter(G, name, motif_id)
+    highlighter.name = "{}, {}: {}, z: {:.2f}, p: {:.3f} ({}, {} samples)".format(name, motif_id, count, z, p, model, samples)
+    return highlighter
+
+# Get the partition either from the cache or generate it using the likelihood algorithm
+partitions = cache.ArrayCache("partitions")
+def get_partition(G, c = 2, trials = 5, seed = 0):
+    key = cache.make_key(cache.graph_hash(G), c, trials, seed, partition.ALGORITHM_VERSION)
+    cached = partitions.load(key)
+    if cached is not None:
+        return cached["z"]
+
+    logL, z, traces = partition.get_partition_runs(G, c = c, trials = trials, processes = None, seed = seed) # One trial per core
+    partitions.save(key, z = z.astype(np.min_scalar_type(c)), logL = logL) # Save to cache
     return z
 
+# Colors each node and its edges by the group it belongs to in the partition z
+def color_partition(highlighter, G, z, c):
+    max_degree = 1 / max(c - 1, 1)
+    hue = (np.asarray(z) * max_degree) * 0.6 # Make it less than 1 so we don't get red values for max and min
+    colors = hl.hsv_to_rgb(hue[np.asarray(list(G.nodes))], 1, 1) # z is indexed by node, the colors by position in G.nodes
+    node_colors = hl.MaterialTable(len(colors), colors, colors, (0.0, 0.0, 0.0), 1)
+    edge_colors = np.column_stack((colors[highlighter.get_edge_endpoints()], np.full(2 * G.number_of_edges(), 0.5)))
+    highlighter.set_node_colors(node_colors)
+    highlighter.set_edge_colors(edge_colors)
+
 # Creates a partition based on max likelihoods and render that in nodes
-def partition_highlighter(G, partition_filename, c = 2):
-    z = get_partition(G, partition_filename, c)
+def partition_highlighter(G, c = 2):
+    z = get_partition(G, c)
 
     highlighter = hl.Highlighter(G)
-    max_degree = 1 / max(z)
-    hue = lambda group : (group * max_degree) * 0.6 # Make it less than 1 so we don't get red values for max and min
-    node_colors = [hl.Material(
-                colorsys.hsv_to_rgb(hue(group), 1, 1), 
-                colorsys.hsv_to_rgb(hue(group), 1, 1),
-            (0.0, 0.0, 0.0), 1) for group in z]
-    edge_colors = [(*colorsys.hsv_to_rgb(hue(z[node]), 1, 1), 0.5) for edge in G.edges for node in edge]
-    highlighter.set_node_colors(node_colors)
-    highlighter.set_edge_colors(edge_colors)
+    color_partition(highlighter, G, z, max(z) + 1)
+    highlighter.set_light_color(hl.Material((5, 5, 5), (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 0)) # Makes the nodes neon!
+
+    return highlighter
+
+# Shows the partition while it is being optimized, recoloring from the best partition found so far
+def live_partition_highlighter(G, name, c = 2, seed = None):
+    def recolor(highlighter, snapshot):
+        phase, step, z, logL = snapshot
+        color_partition(highlighter, G, z, c)
+        highlighter.name = "{}, Phase: {}, Log-likelihood: {:.2f}{}".format(name, phase, logL, "" if step is not None else " (converged)")
+
+    highlighter = hl.StreamHighlighter(G, partition.iter_partition(G, c, seed), recolor)
+    highlighter.name = name
+    highlighter.set_light_color(hl.Material((5, 5, 5), (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 0)) # Makes the nodes neon!
+
+    return highlighter
+
+# Sweeps of c are cached like partitions, so every highlighter over the same graph shares one sweep
+sweeps = cache.ArrayCache("sweeps")
+def get_sweep(G, cs, trials = 5, seed = 0):
+    cs = sorted(cs)
+    key = cache.make_key(cache.graph_hash(G), cs, trials, seed, partition.ALGORITHM_VERSION)
+    cached = sweeps.load(key)
+    if cached is None:
+        sweep = partition.sweep_c(G, cs, trials = trials, seed = seed)
+        cached = {
+            "logL" : np.array([sweep[c][0] for c in cs]),
+            "z" : np.array([sweep[c][1] for c in cs]).astype(np.min_scalar_type(max(cs))),
+            "score" : np.array([sweep[c][2] for c in cs])}
+        sweeps.save(key, **cached)
+
+    return {c : (cached["logL"][i], cached["z"][i], cached["score"][i]) for i, c in enumerate(cs)}
+
+# Partitions the network with the number of groups that has the best information criterion score out of cs
+def best_c_highlighter(G, name, cs = range(2, 7)):
+    sweep = get_sweep(G, cs)
+    c = min(sweep, key=lambda c: sweep[c][2])
+    logL, z, score = sweep[c]
+
+    highlighter = hl.Highlighter(G)
+    highlighter.name = "{}, Groups: {}, Log-likelihood: {:.2f}".format(name, c, logL)
+    color_partition(highlighter, G, z, c)
     highlighter.set_light_color(hl.Material((5, 5, 5), (0.0, 0.0, 0.0), (0.0, 0.0, 0.0), 0)) # Makes the nodes neon!
 
     return highlighter
 
 # Adjust the positions of the initial layout 
-def partition_layout_adjusted(G, partition_filename):
-    highlighter = partition_highlighter(G, partition_filename)
-    z = get_partition(G, partition_filename)
+def partition_layout_adjusted(G):
+    highlighter = partition_highlighter(G)
+    z = get_partition(G)
     group_0 = lambda : [rand.random() * 0.01 + 0.1 for i in range(3)]
     group_1 = lambda : [rand.random() * 0.01 - 0.1 for i in range(3)]
     pos = {node : group_1() if z[node] == 1 else group_0() for node in G}
     highlighter.layout = nx.spring_layout(G, dim=3, scale=9, pos=pos)
     return highlighter
 
-def load_network(filename):
-    path = Path(__file__).parent / "./data/{}".format(filename)
-    return nx.convert_node_labels_to_integers(nx.read_gml(str(path), label='id')) # map node names to integers (0:n-1) [because indexing]
-
-g_metabolism = load_network("metabolism_afulgidus.gml")
-metabolism_in_degree = [degree for node, degree in g_metabolism.in_degree]
-mean_in_degree = sum(metabolism_in_degree) / g_metabolism.number_of_nodes()
-
-metabolism_null = nx.fast_gnp_random_graph(g_metabolism.number_of_nodes(), mean_in_degree / g_metabolism.number_of_nodes(), directed=True)
-
-g_karate = load_network("karate.gml")
-g_yeast = load_network("yeast_spliceosome.gml")
-g_grass = load_network("grass_web.gml")
-path = Path(__file__).parent / "./data/p.pacificus_neural.synaptic_1.graphml"
-g_multi = nx.convert_node_labels_to_integers(nx.read_graphml(str(path))) # map node names to integers (0:n-1) [because indexing]
-g_neural = nx.Graph()                     # G will be a simple graph
-g_neural.add_edges_from(g_multi.edges())        # G is now a simplified Gmulti (tricky :)
-
-G_30 = nx.fast_gnp_random_graph(30, 3 / 30, directed=True)
-
-G_300 = nx.fast_gnp_random_graph(300, 3 / 300)
-
-block_nodes = [10, 15, 10, 15]
-
-# Create an ordered structure
-block_matrix = [
-    [10 / block_nodes[0], 5 / block_nodes[0], 1 / block_nodes[0], 0],
-    [5 / block_nodes[0], 10 / block_nodes[1], 5 / block_nodes[1], 1 / block_nodes[1]],
-    [1 / block_nodes[0], 5 / block_nodes[1], 10 / block_nodes[2], 5 / block_nodes[2]],
-    [0                  , 1 / block_nodes[1], 5 / block_nodes[2], 10 / block_nodes[3]]
-]
-
-block_model = nx.stochastic_block_model(block_nodes, block_matrix)
-
-rand.seed(101) # Just to make sure the visualizations we have don't get messed up due to bad luck
-vs.visualize(highlighters=[
-    text_highlighter(g_metabolism),
-    triangle_highlighter(G_300, "ER Network, N: 300, <k>: 3"), 
-    # triangle_highlighter(g_yeast, "Yeast Splicesome"), 
-    # triangle_highlighter(g_grass, "Grass Web"), 
-    # partition_highlighter(g_karate, "karate_partition"),
-    # partition_highlighter(block_model, "block_partition", c=4),
-    # partition_highlighter(g_metabolism, "metabolism_partition"),
-    # partition_layout_adjusted(g_metabolism, "metabolism_partition"), 
-    # partition_highlighter(g_neural, "neural_partition"),
-    # partition_layout_adjusted(g_neural, "neural_partition"),
-    # partition_highlighter(g_yeast, "yeast_partition"),
-    # partition_layout_adjusted(g_yeast, "yeast_partition"), 
-    # partition_highlighter(g_grass, "grass_web_partition"),
-    # partition_layout_adjusted(g_grass, "grass_web_partition"), 
-    # degree_vibrance_highlighter(g_karate, use_hue=True), 
-    # triangle_highlighter(g_karate, "Karate Network"), 
-    # triangle_highlighter(metabolism_null, "Metabolism Network", feed_back_loop=True),
-    ], view_mode=0)
\ No newline at end of file
+# Spawned worker processes (see partition.get_partition_runs) import this module, so only build the scene when run directly
+if __name__ == "__main__":
+    g_metabolism = load_network("metabolism_afulgidus.gml")
+    metabolism_in_degree = [degree for node, degree in g_metabolism.in_degree]
+    mean_in_degree = sum(metabolism_in_degree) / g_metabolism.number_of_nodes()
+
+    metabolism_null = nx.fast_gnp_random_graph(g_metabolism.number_of_nodes(), mean_in_degree / g_metabolism.number_of_nodes(), directed=True)
+
+    g_karate = load_network("karate.gml")
+    g_yeast = load_network("yeast_spliceosome.gml")
+    g_grass = load_network("grass_web.gml")
+    g_neural = load_neural()
+
+    G_30 = nx.fast_gnp_random_graph(30, 3 / 30, directed=True)
+
+    G_300 = nx.fast_gnp_random_graph(300, 3 / 300)
+
+    block_nodes = [10, 15, 10, 15]
+
+    # Create an ordered structure
+    block_matrix = [
+        [10 / block_nodes[0], 5 / block_nodes[0], 1 / block_nodes[0], 0],
+        [5 / block_nodes[0], 10 / block_nodes[1], 5 / block_nodes[1], 1 / block_nodes[1]],
+        [1 / block_nodes[0], 5 / block_nodes[1], 10 / block_nodes[2], 5 / block_nodes[2]],
+        [0                  , 1 / block_nodes[1], 5 / block_nodes[2], 10 / block_nodes[3]]
+    ]
+
+    block_model = nx.stochastic_block_model(block_nodes, block_matrix)
+
+    rand.seed(101) # Just to make sure the visualizations we have don't get messed up due to bad luck
+    vs.visualize(highlighters=[
+        text_highlighter(g_metabolism),
+        triangle_highlighter(G_300, "ER Network, N: 300, <k>: 3"), 
+        # triangle_highlighter(g_yeast, "Yeast Splicesome"), 
+        # triangle_highlighter(g_grass, "Grass Web"), 
+        # partition_highlighter(g_karate),
+        # partition_highlighter(block_model, c=4),
+        # best_c_highlighter(block_model, "Block Model"),
+        # partition_highlighter(g_metabolism),
+        # live_partition_highlighter(g_metabolism, "Metabolism Network"),
+        # partition_layout_adjusted(g_metabolism), 
+        # partition_highlighter(g_neural),
+        # partition_layout_adjusted(g_neural),
+        # partition_highlighter(g_yeast),
+        # partition_layout_adjusted(g_yeast), 
+        # partition_highlighter(g_grass),
+        # partition_layout_adjusted(g_grass), 
+        # degree_vibrance_highlighter(g_karate, use_hue=True), 
+        # triangle_highlighter(g_karate, "Karate Network"), 
+        # triangle_highlighter(metabolism_null, "Metabolism Network", feed_back_loop=True),
+        # motif_highlighter(g_metabolism, "Metabolism Network", "030C"),
+        # motif_highlighter(g_neural, "Neural Network", "4-cycle"),
+        # significance_highlighter(g_metabolism, "Metabolism Network"),
+        # animated_layout_highlighter(g_metabolism, "Metabolism Network"),
+        # temporal_highlighter("HVR_5.txt", "HVR 5"),
+        ], view_mode=0)
\ No newline at end of file
@@ -0,0 +1,237 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+# Motif membership with sparse matrix products instead of walking every node, neighbor and second neighbor.
+# Results are boolean masks aligned with G.nodes and G.edges, so colors can be built straight from them.
+
+def adjacency(G):
+    # input  : G a graph or directed graph
+    # output : the 0/1 CSR adjacency of G in G.nodes order without self loops, and the index of every node in it
+    index = {node : i for i, node in enumerate(G.nodes)}
+    A = nx.to_scipy_sparse_array(G, nodelist=list(G.nodes), weight=None, format="csr")
+    A = sp.csr_matrix(A, dtype=np.int64)
+    A.setdiag(0)
+    A.eliminate_zeros()
+    A.data[:] = 1
+    return A, index
+
+def edge_index(G, index):
+    # output : the (row, column) positions of G.edges in the adjacency
+    edges = np.array([(index[u], index[v]) for u, v in G.edges], dtype=int).reshape(-1, 2)
+    return edges[:, 0], edges[:, 1]
+
+def cycle_edges(A):
+    # Returns the sparse matrix that is nonzero at (i, j) when the edge i -> j closes a cycle i -> j -> k -> i.
+    # (A A)[j, i] counts the paths j -> k -> i, so the cycle edges are A ∘ (A A)^T. For a symmetric (undirected)
+    # adjacency these are exactly the edges of triangles. Without self loops k can't be i or j.
+    C = A.multiply((A @ A).T).tocsr()
+    C.eliminate_zeros()
+    return C
+
+def cycle_masks(G):
+    # input  : G a graph or directed graph
+    # output : node_mask, True for the nodes on a triangle (directed 3-cycle if G is directed), aligned with G.nodes
+    #        : edge_mask, True for the edges of G.edges on one, aligned with G.edges. For directed graphs an edge
+    #          also counts when its reverse is on a cycle, as in the original find_triangles
+    A, index = adjacency(G)
+    C = cycle_edges(A)
+    node_mask = np.diff(C.indptr) > 0
+
+    rows, cols = edge_index(G, index)
+    on_cycle = (C + C.T).tocsr()
+    edge_mask = np.asarray(on_cycle[rows, cols]).ravel() > 0 if len(rows) else np.zeros(0, dtype=bool)
+    return node_mask, edge_mask
+
+def triangle_masks(G):
+    # Nodes and edges that are part of a triangle (see cycle_masks)
+    return cycle_masks(G)
+
+def feed_back_loop_masks(G):
+    # Nodes and edges that are part of a feed back loop i -> j -> k -> i (see cycle_masks)
+    return cycle_masks(G)
+
+# The 13 connected directed triads in networkx.triadic_census naming (an undirected graph only has 201 and 300)
+TRIADS = ["021D", "021U", "021C", "111D", "111U", "030T", "030C", "201", "120D", "120U", "120C", "210", "300"]
+
+# The 6 connected 4 node undirected motifs, with the number of edges in each
+QUADS = ["3-star", "4-path", "tailed triangle", "4-cycle", "diamond", "4-clique"]
+QUAD_EDGES = np.array([3, 3, 4, 4, 5, 6])
+
+MOTIFS = TRIADS + QUADS
+
+def triad_table():
+    # Returns the index in TRIADS of every 6 bit code of a triad (v, a, b), with the bits v->a, a->v, v->b, b->v,
+    # a->b, b->a from lowest to highest, or -1 for the disconnected ones
+    bits = [(0, 1), (1, 0), (0, 2), (2, 0), (1, 2), (2, 1)]
+    table = np.full(64, -1)
+    for code in range(64):
+        D = nx.DiGraph()
+        D.add_nodes_from(range(3))
+        D.add_edges_from(edge for bit, edge in enumerate(bits) if code >> bit & 1)
+        triad = next(name for name, count in nx.triadic_census(D).items() if count)
+        if triad in TRIADS:
+            table[code] = TRIADS.index(triad)
+    return table
+
+TRIAD_TABLE = triad_table()
+
+def skeleton(A):
+    # Returns the symmetric 0/1 adjacency ignoring edge directions, and the rows and columns of its edges (row < column)
+    S = ((A + A.T) > 0).astype(np.int64).tocsr()
+    S.sort_indices()
+    upper = sp.triu(S, 1).tocoo()
+    order = np.lexsort((upper.col, upper.row))
+    return S, upper.row[order], upper.col[order]
+
+def edge_lookup(n, rows, cols):
+    # Returns a function that finds the position of every (i, j) pair among the sorted (rows, cols) pairs (i < j),
+    # along with whether it was found, so arrays over the skeleton edges can be gathered onto G.edges
+    keys = rows.astype(np.int64) * n + cols
+    def find(i, j):
+        query = np.minimum(i, j).astype(np.int64) * n + np.maximum(i, j)
+        position = np.minimum(np.searchsorted(keys, query), max(len(keys) - 1, 0))
+        found = keys[position] == query if len(keys) else np.zeros(len(query), dtype=bool)
+        return position, found
+    return find
+
+def on_edges(G, index, find, counts):
+    # Gathers counts (k x skeleton edges) onto G.edges, with self loops counting nothing
+    rows, cols = edge_index(G, index)
+    position, found = find(rows, cols)
+    return np.where(found, counts[:, position] if len(rows) else counts[:, :0], 0)
+
+def triad_census(G):
+    # Counts the connected 3 node subgraphs of G by their directed triad type
+    #
+    # input  : G a graph or directed graph (undirected edges count as reciprocated)
+    # output : totals, the number of each type of triad in TRIADS order
+    #        : node_counts, len(TRIADS) x n, the triads of each type every node (in G.nodes order) is in
+    #        : edge_counts, len(TRIADS) x m, the triads of each type every edge (in G.edges order) is in
+    A, index = adjacency(G)
+    n = A.shape[0]
+    S, rows, cols = skeleton(A)
+    find = edge_lookup(n, rows, cols)
+
+    # Every connected triad is a pair of neighbors a < b of a center v. When a and b are adjacent it is a triangle
+    # that every one of its nodes is the center of, so only keep it from its smallest node
+    centers, firsts, seconds = [], [], []
+    for v in range(n):
+        neighbors = S.indices[S.indptr[v]:S.indptr[v + 1]]
+        i, j = np.triu_indices(len(neighbors), 1)
+        centers.append(np.full(len(i), v))
+        firsts.append(neighbors[i])
+        seconds.append(neighbors[j])
+    v, a, b = (np.concatenate(parts).astype(np.int64) if parts else np.zeros(0, dtype=np.int64) for parts in (centers, firsts, seconds))
+
+    closing, closed = find(a, b)
+    keep = ~closed | ((v < a) & (v < b))
+    v, a, b, closing, closed = v[keep], a[keep], b[keep], closing[keep], closed[keep]
+
+    # The directed edges are looked up as sorted keys i * n + j
+    keys = np.sort(np.ravel_multi_index(A.nonzero(), (n, n)))
+    def has(i, j):
+        query = i * n + j
+        return keys[np.minimum(np.searchsorted(keys, query), len(keys) - 1)] == query
+    bits = [has(v, a), has(a, v), has(v, b), has(b, v), has(a, b), has(b, a)]
+    types = TRIAD_TABLE[sum(bit.astype(int) << shift for shift, bit in enumerate(bits))]
+
+    k = len(TRIADS)
+    totals = np.bincount(types, minlength=k)
+    node_counts = sum(np.bincount(types * n + nodes, minlength=k * n) for nodes in (v, a, b)).reshape(k, n)
+
+    pairs = len(rows)
+    pair_counts = np.bincount(types * pairs + find(v, a)[0], minlength=k * pairs)
+    pair_counts += np.bincount(types * pairs + find(v, b)[0], minlength=k * pairs)
+    pair_counts += np.bincount((types * pairs + closing)[closed], minlength=k * pairs)
+    edge_counts = on_edges(G, index, find, pair_counts.reshape(k, pairs))
+    return totals, node_counts, edge_counts
+
+def quad_census(G):
+    # Counts the connected 4 node subgraphs of G by their undirected motif, ignoring edge directions
+    #
+    # input  : G a graph or directed graph
+    # output : totals, the number of each motif in QUADS order
+    #        : node_counts, len(QUADS) x n, the motifs of each kind every node (in G.nodes order) is in
+    #        : edge_counts, len(QUADS) x m, the motifs of each kind every edge (in G.edges order) is in
+    #
+    # Nothing is enumerated but the 4-cliques. For an edge (u, v), every other node is in T (adjacent to both),
+    # U (only u), V (only v) or N (neither), and the motif induced by {u, v, a, b} only depends on the sets a and b
+    # are in and whether they are adjacent. The number of edges between the sets comes from sparse products.
+    A, index = adjacency(G)
+    n = A.shape[0]
+    S, u, v = skeleton(A)
+    find = edge_lookup(n, u, v)
+    at = lambda M : np.asarray(M[u, v]).ravel().astype(float) if len(u) else np.zeros(0)
+
+    d = np.asarray(S.sum(axis=1)).ravel().astype(float)
+    S2 = S @ S
+    W = S.multiply(S2).tocsr() # triangles on every edge
+    triangles = np.asarray(W.sum(axis=1)).ravel() / 2
+
+    T = at(S2)
+    Su, Sv = d[u] - 1 - T, d[v] - 1 - T
+
+    # Edges among T are the 4-cliques on the edge
+    M = S[u].multiply(S[v]).tocsr()
+    K = np.asarray((M @ S).multiply(M).sum(axis=1)).ravel() / 2 if len(u) else np.zeros(0)
+
+    # Sum over a in T of |N(u) ∩ N(a)| counts v, the edges among T twice and the edges from T to U
+    E_TU = at(W @ S) - T - 2 * K
+    E_TV = at(S @ W) - T - 2 * K
+    # The triangles at u are the edges within N(u) = T + U + v
+    E_UU = triangles[u] - K - E_TU - T
+    E_VV = triangles[v] - K - E_TV - T
+    # Walks u -> a -> b -> v with a != v and b != u go from T + U to T + V
+    E_UV = at(S @ S2) - d[u] - d[v] + 1 - 2 * K - E_TU - E_TV
+    # Whatever is left of the degrees of T, U and V leaves for N
+    degree_T = at(S.multiply(d[None, :]) @ S)
+    degree_U = (S @ d)[u] - d[v] - degree_T
+    degree_V = (S @ d)[v] - d[u] - degree_T
+    E_TN = degree_T - 2 * T - 2 * K - E_TU - E_TV
+    E_UN = degree_U - Su - E_TU - 2 * E_UU - E_UV
+    E_VN = degree_V - Sv - E_TV - 2 * E_VV - E_UV
+
+    # Every kind of pair (a, b), the motif it makes, and the degrees of u and v in it
+    pair = lambda x : x * (x - 1) / 2
+    kinds = [
+        (5, K, 3, 3), # T T adjacent
+        (4, pair(T) - K, 3, 3), # T T
+        (4, E_TU, 3, 2), # T U adjacent
+        (4, E_TV, 2, 3),
+        (2, T * Su - E_TU, 3, 2), # T U
+        (2, T * Sv - E_TV, 2, 3),
+        (2, E_TN, 2, 2), # T N adjacent
+        (2, E_UU, 3, 1), # U U adjacent
+        (2, E_VV, 1, 3),
+        (3, E_UV, 2, 2), # U V adjacent
+        (0, pair(Su) - E_UU, 3, 1), # U U
+        (0, pair(Sv) - E_VV, 1, 3),
+        (1, Su * Sv - E_UV, 2, 2), # U V
+        (1, E_UN, 2, 1), # U N adjacent
+        (1, E_VN, 1, 2),
+    ]
+
+    k = len(QUADS)
+    pair_counts = np.zeros((k, len(u)))
+    node_counts = np.zeros((k, n))
+    for motif, count, degree_u, degree_v in kinds:
+        pair_counts[motif] += count
+        # A node is in as many motifs as the edges it has in them divided by its degree in each
+        node_counts[motif] += np.bincount(u, count / degree_u, minlength=n) + np.bincount(v, count / degree_v, minlength=n)
+
+    totals = np.rint(pair_counts.sum(axis=1) / QUAD_EDGES).astype(np.int64)
+    node_counts = np.rint(node_counts).astype(np.int64)
+    edge_counts = on_edges(G, index, find, np.rint(pair_counts).astype(np.int64))
+    return totals, node_counts, edge_counts
+
+def motif_census(G):
+    # Runs both censuses on G
+    # output : totals, node_counts, edge_counts, dictionaries from every motif in MOTIFS to its total, and its counts
+    #          per node (aligned with G.nodes) and per edge (aligned with G.edges)
+    totals, node_counts, edge_counts = {}, {}, {}
+    for names, census in ((TRIADS, triad_census), (QUADS, quad_census)):
+        counts = census(G)
+        for i, name in enumerate(names):
+            totals[name], node_counts[name], edge_counts[name] = counts[0][i], counts[1][i], counts[2][i]
+    return totals, node_counts, edge_counts
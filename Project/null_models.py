@@ -0,0 +1,111 @@
+import numpy as np
+import networkx as nx
+from concurrent.futures import ProcessPoolExecutor
+import cache
+import motifs
+
+# Degree preserving null models, for telling whether a motif is over or under represented in a network. Ensembles of
+# randomized graphs are generated across processes and only their motif counts are kept, cached on disk by the
+# graph's hash, the model and the number of samples, so building the same highlighter again costs nothing.
+
+SWAPS_PER_EDGE = 10 # Edge swaps made per edge of the graph before a swap chain is taken as mixed
+
+def configuration_sample(G, seed = None):
+    # A configuration model graph with the degrees (in and out degrees if directed) of G. Self loops and multi edges
+    # are dropped, so the degrees are only preserved approximately
+    seed = int(seed.generate_state(1)[0]) if isinstance(seed, np.random.SeedSequence) else seed # networkx takes integer seeds
+    nodes = list(G.nodes)
+    if nx.is_directed(G):
+        multigraph = nx.directed_configuration_model([G.in_degree[node] for node in nodes], [G.out_degree[node] for node in nodes], seed=seed)
+        sample = nx.DiGraph(multigraph)
+    else:
+        sample = nx.Graph(nx.configuration_model([G.degree[node] for node in nodes], seed=seed))
+    sample.remove_edges_from(list(nx.selfloop_edges(sample)))
+    return nx.relabel_nodes(sample, dict(enumerate(nodes)))
+
+def edge_swap_sample(G, seed = None):
+    # G after a Maslov-Sneppen Markov chain of edge swaps, which keeps the degrees (in and out degrees if directed)
+    # exactly. Every step picks two edges a -> b and c -> d and rewires them to a -> d and c -> b, unless that would
+    # make a self loop or an edge that already exists. Undirected edges are swapped in a random orientation.
+    rng = np.random.default_rng(seed)
+    directed = nx.is_directed(G)
+    edges = [edge for edge in G.edges if edge[0] != edge[1]]
+    present = set(edges) if directed else set(edges) | {(v, u) for u, v in edges}
+
+    swaps = SWAPS_PER_EDGE * len(edges)
+    if len(edges) < 2:
+        swaps = 0
+    firsts, seconds = rng.integers(len(edges), size=(2, swaps)) if swaps else ((), ())
+    flips = rng.random(swaps) < 0.5
+    for i, j, flip in zip(firsts, seconds, flips):
+        (a, b), (c, d) = edges[i], edges[j]
+        if flip and not directed:
+            c, d = d, c
+        if a == d or c == b or (a, d) in present or (c, b) in present:
+            continue
+
+        for old in ((a, b), (c, d)):
+            present.discard(old)
+            if not directed:
+                present.discard(old[::-1])
+        for new in ((a, d), (c, b)):
+            present.add(new)
+            if not directed:
+                present.add(new[::-1])
+        edges[i], edges[j] = (a, d), (c, b)
+
+    sample = G.__class__()
+    sample.add_nodes_from(G.nodes)
+    sample.add_edges_from(edges)
+    return sample
+
+MODELS = {
+    "configuration" : configuration_sample,
+    "edge swap" : edge_swap_sample,
+}
+
+def census_totals(G):
+    # The motif counts of G in motifs.MOTIFS order
+    totals = motifs.motif_census(G)[0]
+    return np.array([totals[motif] for motif in motifs.MOTIFS])
+
+def _sample_totals(G, model, seed):
+    return census_totals(MODELS[model](G, seed))
+
+ensembles = cache.ArrayCache("ensembles")
+
+def ensemble_counts(G, model = "edge swap", samples = 100, processes = None, seed = 0):
+    # Counts the motifs of an ensemble of randomizations of G
+    #
+    # input  : model, one of MODELS; samples, the size of the ensemble
+    #        : processes, the number of worker processes (None for one per CPU)
+    #        : seed, the root seed, every sample gets its own seed spawned from it
+    # output : samples x len(motifs.MOTIFS), the motif counts of every sample
+    key = cache.make_key(cache.graph_hash(G), model, samples, seed, SWAPS_PER_EDGE, motifs.MOTIFS)
+    cached = ensembles.load(key)
+    if cached is not None:
+        return cached["counts"]
+
+    seeds = np.random.SeedSequence(seed).spawn(samples)
+    with ProcessPoolExecutor(processes) as executor:
+        counts = np.array(list(executor.map(_sample_totals, [G]*samples, [model]*samples, seeds, chunksize=max(1, samples // 32))))
+
+    ensembles.save(key, counts=counts)
+    return counts
+
+def motif_significance(G, model = "edge swap", samples = 100, processes = None, seed = 0):
+    # Compares the motif counts of G to an ensemble of its randomizations (see ensemble_counts)
+    # output : a dictionary from every motif in motifs.MOTIFS to (count, z, p). z is the count's z-score in the ensemble
+    #          (+-inf if the ensemble never varies but the count differs), p is the two sided empirical p-value, the
+    #          share of samples at least as far from the ensemble mean as the count (with one added for the count itself)
+    observed = census_totals(G)
+    counts = ensemble_counts(G, model, samples, processes, seed)
+    mean, std = counts.mean(axis=0), counts.std(axis=0)
+
+    difference = observed - mean
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std > 0, difference / std, np.where(difference == 0, 0.0, np.sign(difference) * np.inf))
+    extreme = np.abs(counts - mean) >= np.abs(difference) - 1e-9
+    p = (1 + extreme.sum(axis=0)) / (1 + samples)
+
+    return {motif : (int(observed[i]), float(z[i]), float(p[i])) for i, motif in enumerate(motifs.MOTIFS)}
@@ -1,6 +1,61 @@
 import numpy as np
 import networkx as nx
-import random as rnd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import scipy.sparse as sp
+import weakref
+import time
+import instrumentation
+
+# Identifies the partitions this module produces for a given graph, c and seed. Bump it whenever a change would
+# alter them, so cached partitions (see cache.py) from the old version are not reused.
+ALGORITHM_VERSION = 1
+
+class GraphArrays():
+    # The graph converted once into a CSR adjacency and a degree vector for the vectorized DC-SBM backend.
+    # adj[i, j] counts the stubs of i toward j: every edge (i, j) adds one to adj[i, j] and one to adj[j, i]
+    # (so a self loop adds two to adj[i, i]), which is exactly how tabulate_ek counts edges.
+    # nodes() and order() mirror the networkx calls the partition functions make, so either can be passed as G.
+    def __init__(self, adj):
+        self.adj = sp.csr_matrix(adj, dtype=float)
+        self.n = self.adj.shape[0]
+        self.degrees = np.asarray(self.adj.sum(axis=1)).ravel()
+
+    def nodes(self):
+        return range(self.n)
+
+    def order(self):
+        return self.n
+
+# Graphs that have already been converted, with the edges they were converted from
+_arrays_cache = weakref.WeakKeyDictionary()
+
+def graph_arrays(G):
+    # The cached arrays are checked against the graph's current edges, so a graph rewired in place (even keeping
+    # its node and edge counts) is converted again. Only building the sparse matrix is saved, so the partition
+    # functions convert once up front and pass the GraphArrays around.
+    #
+    # input  : G a graph whose nodes are labeled 0 to n-1, or a GraphArrays which is returned as is
+    # output : the GraphArrays of G
+    if isinstance(G, GraphArrays):
+        return G
+
+    n = G.order()
+    edges = np.array(G.edges(), dtype=int).reshape(-1, 2)
+    cached = _arrays_cache.get(G)
+    if cached is not None and cached[0] == n and np.array_equal(cached[1], edges):
+        return cached[2]
+
+    adj = sp.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n))
+    arrays = GraphArrays(adj + adj.T) # duplicate entries are summed by the conversion to CSR
+
+    _arrays_cache[G] = (n, edges, arrays)
+    return arrays
+
+def group_matrix(z, c):
+    # Returns the n x c one-hot sparse matrix Z with Z[i, z_i] = 1
+    z = np.asarray(z, dtype=int)
+    return sp.csr_matrix((np.ones(len(z)), (np.arange(len(z)), z)), shape=(len(z), c))
 
 def tabulate_ek(G,z,c):
     # This function tabulates the e_rs and kappa_r auxiliary data structures for the DC-SBM
@@ -14,30 +69,21 @@ def tabulate_ek(G,z,c):
     kpr = np.zeros(c) # total degree of group r
 
     ##### do not modify above here #####
-    for i, j in G.edges():   
-        
-        # Assumption here is that there are no self loops because then those would be double counted
-        ers[z[i]][z[j]] += 1;
-        ers[z[j]][z[i]] += 1;
-        
-    for node in G.nodes():
-        kpr[z[node]] += G.degree(node) # Adds the node's degree to its group
+    arrays = graph_arrays(G)
+    Z = group_matrix(z, c)
+
+    ers += (Z.T @ arrays.adj @ Z).toarray() # stubs from group r to group s, i.e. Z^T A Z
+    kpr += np.bincount(np.asarray(z, dtype=int), weights=arrays.degrees, minlength=c) # Adds each node's degree to its group
         
     ##### do not modify below here #####
 
     return ers,kpr
 
 # input  : number of nodes n, and number of groups c
+#        : rng, an optional np.random.Generator or seed; by default the partition is seeded from the OS
 # output : returns a random partition z (n x 1), in which z_i = Uniform(0,c-1)
-def random_z(n,c):
-    rnd.seed()
-    
-    z = np.zeros(n, dtype=int)
-
-    for i in range(n):
-        z[i] = np.random.choice([i for i in range(c)])
-    
-    return z
+def random_z(n,c,rng=None):
+    return np.random.default_rng(rng).integers(0, c, size=n)
 
 def dcsbm_LogL(ers,kpr):
     # This function calculates the log-likelihood of the degree-corrected stochastic block model (DC-SBM)
@@ -47,100 +93,563 @@ def dcsbm_LogL(ers,kpr):
     #        : kpr is a c x 1 np.array of stub counts 
     # output : the dcsbm log-likelihood
     
-    c = ers.shape[1]  # number of groups
-    
-    logL = 0
-    for r in range(c):
-        for s in range(c):
-            if ers[r,s] < 1 or kpr[r] < 1 or kpr[s] < 1:
-                temp = 0 # define 0^0 = 1
-            else:
-                temp = ers[r,s]*np.log( ers[r,s] / (kpr[r]*kpr[s]) )
-            logL = logL + temp
-    
-    return logL
+    return logL_terms(ers, kpr[:, None], kpr[None, :]).sum()
+
+def logL_terms(e, kr, ks):
+    # The (r, s) terms of the sum in dcsbm_LogL for arrays of stub counts e and group degrees kr, ks (broadcast together)
+    e, kk = np.broadcast_arrays(np.asarray(e, dtype=float), np.multiply(kr, ks, dtype=float))
+    valid = (e >= 1) & (np.broadcast_to(kr, e.shape) >= 1) & (np.broadcast_to(ks, e.shape) >= 1)
+
+    terms = np.zeros(e.shape) # define 0^0 = 1
+    terms[valid] = e[valid]*np.log( e[valid] / kk[valid] )
+    return terms
+
+class MoveEngine():
+    # Keeps the DC-SBM auxiliary data structures (ers, kpr) of a partition z as state, so that a single node move
+    # can be scored from the node's per-group neighbor counts instead of re-tabulating every edge of the graph.
+    # Moving a node from group s to group r only changes the rows and columns s and r of ers (and kpr[s], kpr[r]),
+    # so the change in log-likelihood is a sum over those cells alone.
+    #
+    # input  : G is simple graph with n nodes
+    #        : z is n x 1 partition of G into c groups, shared with the caller and updated by move()
+    #        : c is scalar, number of possible groups
+    def __init__(self, G, z, c):
+        self.arrays = graph_arrays(G)
+        self.z = z if isinstance(z, np.ndarray) else np.asarray(z, dtype=int)
+        self.c = c
+        self.ers, self.kpr = tabulate_ek(self.arrays, self.z, c)
+        self.logL = dcsbm_LogL(self.ers, self.kpr)
+
+    def neighbor_counts(self, i):
+        # output : counts, the number of i's stubs that land in each group (self loops excluded)
+        #        : loops, the number of i's stubs that belong to self loops
+        adj = self.arrays.adj
+        neighbors = adj.indices[adj.indptr[i]:adj.indptr[i + 1]]
+        stubs = adj.data[adj.indptr[i]:adj.indptr[i + 1]]
+        loop = neighbors == i
 
-def makeAMove(G,z,c,f):
+        counts = np.bincount(self.z[neighbors[~loop]], weights=stubs[~loop], minlength=self.c)
+        return counts, stubs[loop].sum()
+
+    def moved(self, i, r, counts, loops):
+        # Returns the ers, kpr that result from moving node i from its current group into group r
+        s = int(self.z[i])
+        ers = self.ers.copy()
+        kpr = self.kpr.copy()
+        ers[s, :] -= counts
+        ers[:, s] -= counts
+        ers[r, :] += counts
+        ers[:, r] += counts
+        ers[s, s] -= loops
+        ers[r, r] += loops
+        kpr[s] -= counts.sum() + loops
+        kpr[r] += counts.sum() + loops
+        return ers, kpr
+
+    def cross_terms(self, ers, kpr, s, r):
+        # Sum of the log-likelihood terms over rows and columns s and r (s != r).
+        # ers is symmetric, so the columns contribute the same as the rows, minus the s, r block counted twice.
+        rows = [s, r]
+        terms = logL_terms(ers[rows, :], kpr[rows][:, None], kpr[None, :])
+        return 2*terms.sum() - terms[:, rows].sum()
+
+    def delta(self, i, r, counts, loops):
+        # The change in log-likelihood from moving node i into group r
+        s = int(self.z[i])
+        ers, kpr = self.moved(i, r, counts, loops)
+        return self.cross_terms(ers, kpr, s, r) - self.cross_terms(self.ers, self.kpr, s, r)
+
+    def move(self, i, r):
+        # Moves node i into group r and updates the state to match
+        counts, loops = self.neighbor_counts(i)
+        self.ers, self.kpr = self.moved(i, r, counts, loops)
+        self.z[i] = r
+        self.logL = dcsbm_LogL(self.ers, self.kpr)
+
+def makeAMove(G,z,c,f,engine=None):
     # For each non 'frozen' node in the current partition, this function tries all (c-1) possible group moves for it
     # It returns the combination of [node i and new group r] that produces the best log-likelihood over the non-frozen set
     # input  : G a graph
     #        : z a nx1 partition of G's nodes
     #        : c the number of groups
     #        : fr a nx1 binary vector of frozen nodes
+    #        : engine an optional MoveEngine already tabulated for z, so it can be reused across moves
     # output : bestL, the best log-likelihood found
     #        : bestMove, [i,r] the node i and new group r to achieve bestL
     
-    bestL    = -np.inf         # the best log-likelihood over all considered moves
+    if engine is None:
+        engine = MoveEngine(G, z, c)
+
+    bestDelta = -np.inf         # the best change in log-likelihood over all considered moves
     bestMove = [-1, -1]         # [node i, group r] assignment for bestL
     for i in G.nodes():
-        #print(z)
         if f[i] == 0:          # if i is not a 'frozen' node
             s = int(z[i])      #  the current label of i
+            counts, loops = engine.neighbor_counts(i)
             for r in range(c): #  try all the groups
                             
                 if r != s: # We don't want to consider not making a move at all (aka setting i from group s -> group s)
-                    z[i] = r
-                    likelihood = dcsbm_LogL(*tabulate_ek(G,z,c))
-                    if likelihood > bestL:
-                        bestL = likelihood
+                    gain = engine.delta(i, r, counts, loops)
+                    if gain > bestDelta:
+                        bestDelta = gain
                         bestMove = [i, r]
 
-            z[i] = s # We don't want to actually change the groups in this function
-                ##### do not modify below here #####    
+    if bestMove[0] == -1:
+        return -np.inf, bestMove
+
+    # Score the chosen move from its full tables so the reported likelihood is exactly what tabulate_ek would give
+    counts, loops = engine.neighbor_counts(bestMove[0])
+    bestL = dcsbm_LogL(*engine.moved(bestMove[0], bestMove[1], counts, loops))
                 
     return bestL,bestMove
 
-def get_partition(G, c = 3):
+class PhaseDriver():
+    # Drives the moves of one phase of get_partition. makeAMove re-scores every (node, group) pair from scratch,
+    # while here the per-node neighbor counts are kept as an n x c matrix and only the moved node's neighbors are
+    # updated after a move. A move changes kpr of the two groups involved, which enters the gain of every candidate
+    # move, so all gains are then re-scored together as arrays instead of one candidate at a time.
+    # The best move is chosen exactly as in makeAMove: the first node in order, then the first group, with the best gain.
+    #
+    # input  : G a graph (or GraphArrays), z a nx1 partition array updated in place, c the number of groups
+    def __init__(self, G, z, c):
+        self.engine = MoveEngine(G, z, c)
+        self.z = self.engine.z
+        self.c = c
+
+        arrays = self.engine.arrays
+        self.loops = arrays.adj.diagonal()
+        self.degrees = arrays.degrees
+        self.neighbors = sp.csr_matrix(arrays.adj - sp.diags(self.loops)) # stubs between different nodes
+        self.neighbors.eliminate_zeros()
+        self.counts = (self.neighbors @ group_matrix(self.z, c)).toarray() # counts[i, t] stubs of i landing in group t
+        self.frozen = np.zeros(arrays.n, dtype=bool)
+        self.scored = 0 # candidate moves scored so far
+
+    def gains(self):
+        # output : an n x c array of the change in log-likelihood from moving node i into group r,
+        #          -inf for frozen nodes and for the group a node is already in
+        gains = np.full((len(self.z), self.c), -np.inf)
+
+        # Only the nodes that can still move are scored, so a phase gets cheaper as nodes freeze
+        nodes = np.flatnonzero(~self.frozen)
+        gains[nodes] = self.node_gains(nodes)
+        return gains
+
+    def node_gains(self, nodes):
+        # output : a len(nodes) x c array of the change in log-likelihood from moving each of nodes alone into group r,
+        #          -inf for the group a node is already in
+        ers, kpr, c = self.engine.ers, self.engine.kpr, self.c
+        gains = np.full((len(nodes), c), -np.inf)
+        z, K, L, d = self.z[nodes], self.counts[nodes], self.loops[nodes], self.degrees[nodes]
+        idx = np.arange(len(nodes))
+        self.scored += len(nodes) * (c - 1)
+
+        # The current rows and columns a and b for every pair of groups a != b (see MoveEngine.cross_terms)
+        terms = logL_terms(ers, kpr[:, None], kpr[None, :])
+        rows = terms.sum(axis=1)
+        old = 2*(rows[:, None] + rows[None, :]) - (np.diag(terms)[:, None] + np.diag(terms)[None, :] + 2*terms)
+
+        for b in range(c):
+            # Rows a and b of ers after each node moves from its group a into b (see MoveEngine.moved)
+            ea = ers[z, :] - K
+            ea[idx, z] -= K[idx, z] + L
+            ea[:, b] += K[idx, z]
+            eb = ers[b, :] + K
+            eb[idx, z] -= K[:, b]
+            eb[:, b] += K[:, b] + L
+            kp = np.tile(kpr, (len(nodes), 1))
+            kp[idx, z] -= d
+            kp[:, b] += d
+
+            ta = logL_terms(ea, kp[idx, z][:, None], kp)
+            tb = logL_terms(eb, kp[:, b][:, None], kp)
+            new = 2*(ta.sum(axis=1) + tb.sum(axis=1)) - (ta[idx, z] + tb[:, b] + 2*ta[:, b])
+            gains[:, b] = np.where(z != b, new - old[z, b], -np.inf)
+
+        return gains
+
+    def boundary(self):
+        # output : the nodes with a stub landing outside their own group
+        own = self.counts[np.arange(len(self.z)), self.z]
+        return np.flatnonzero(own < self.counts.sum(axis=1))
+
+    def best_move(self):
+        # output : bestMove, [i,r] the node i and new group r with the best gain, or [-1, -1] if every node is frozen
+        gains = self.gains()
+        i, r = np.unravel_index(np.argmax(gains), gains.shape)
+        if gains[i, r] == -np.inf:
+            return [-1, -1]
+        return [int(i), int(r)]
+
+    def move(self, i, r):
+        # Moves node i into group r, freezes it, and updates its neighbors' counts
+        s = self.z[i]
+        start, end = self.neighbors.indptr[i], self.neighbors.indptr[i + 1]
+        neighbors, stubs = self.neighbors.indices[start:end], self.neighbors.data[start:end]
+        self.counts[neighbors, s] -= stubs
+        self.counts[neighbors, r] += stubs
+
+        self.engine.move(i, r)
+        self.frozen[i] = True
+
+    def move_all(self, nodes, groups):
+        # Moves every node of nodes into the matching group of groups at once, updating the counts of all of their
+        # neighbors together and re-tabulating ers and kpr (without freezing anything)
+        k = len(nodes)
+        rows = np.concatenate((np.arange(k), np.arange(k)))
+        change = sp.csr_matrix((np.concatenate((np.ones(k), -np.ones(k))), (rows, np.concatenate((groups, self.z[nodes])))), shape=(k, self.c))
+        self.counts += (self.neighbors[nodes].T @ change).toarray() # The neighbors matrix is symmetric
+
+        self.z[nodes] = groups
+        engine = self.engine
+        engine.ers, engine.kpr = tabulate_ek(engine.arrays, self.z, self.c)
+        engine.logL = dcsbm_LogL(engine.ers, engine.kpr)
+
+def partition_moves(G, c = 3, seed = None, z = None, trace = None, stop = None):
+    # The optimizer behind get_partition as a generator. After every move it yields (phase, step, z, logL) with the
+    # best partition found so far and its log-likelihood (z is reused internally, so copy it to keep it),
+    # and when it converges it returns what get_partition returns.
+    #
+    # input  : z, an optional starting partition instead of a random one drawn from seed
+    #        : trace, an optional instrumentation.PartitionTrace that records every phase
+    #        : stop, an optional threading or multiprocessing Event; once it is set the run ends after the current
+    #          move and returns the best partition found so far
+    G  = graph_arrays(G)                # converted once rather than by every phase
     n  = G.order()                      # n, number of nodes
     T  = 30                             # maximum number of phases
     LL = []                             # log-likelihoods over the entire algorithm (.appended)
     flag_converged = 0                  # early-convergence flag
-    z       = random_z(n,c)       # z0, initial partition
+    z       = random_z(n,c,seed) if z is None else np.array(z, dtype=int) # z0, initial partition
     ers,kpr = tabulate_ek(G,z,c)  # ers, kpr, initial DC-SBM parameters
     pc = 0  # counter for number of phases completed
     l_max = dcsbm_LogL(ers,kpr) # Basically replaces the purpose of Lt and simplifies keeping track of the max found
-    z_max = z
+    z_max = np.copy(z)
+
+    if trace is not None:
+        trace.begin_run("partition c = {}, n = {}".format(c, n))
 
     while not flag_converged:
 
-        f     = np.zeros([n,1],dtype=int)  # no nodes frozen
+        if trace is not None:
+            trace.begin_phase(pc)
+
         l_max_phase = l_max # Tracks the max liklihood of this phase
-        z_max_phase = z # Tracks the best partition of this phase
+        z_max_phase = np.copy(z) # Tracks the best partition of this phase
         LL.append(l_max_phase)
 
+        phase = PhaseDriver(G, z, c) # Tabulated once per phase, then kept up to date move by move
+
         # This loop represents one phase
         for j in range(n):
 
-            choiceL, choiceMove = makeAMove(G,z,c,f)
-            f[choiceMove[0]] = 1
-            z[choiceMove[0]] = choiceMove[1]
+            if stop is not None and stop.is_set():
+                break
+            if trace is not None:
+                scored, start = phase.scored, time.perf_counter()
+            choiceMove = phase.best_move()
+            if trace is not None:
+                trace.scored(phase.scored - scored, time.perf_counter() - start)
+            if choiceMove[0] == -1:
+                break # Nothing left to move (every node is frozen, or there is only one group)
+            phase.move(*choiceMove)
+            choiceL = phase.engine.logL
             LL.append(choiceL)
 
             if choiceL > l_max_phase: # Finds the max liklihood of this phase
-                z_max_phase = list(z)
+                z_max_phase = np.copy(z)
                 l_max_phase = choiceL
 
+            yield pc, j, z_max_phase, l_max_phase
+
+        if trace is not None:
+            trace.end_phase(l_max_phase)
+
         # This if statement decides if the algorithm should do another phase
         # If this phase hasn't improved anything since our last phase, then we have converged
-        if l_max_phase <= l_max or pc > T:
+        if stop is not None and stop.is_set():
+            flag_converged = True
+            if l_max_phase > l_max:
+                l_max, z_max = l_max_phase, z_max_phase
+            if trace is not None:
+                trace.converged(instrumentation.STOPPED)
+        elif l_max_phase <= l_max or pc > T:
             # If the max in this phase is no better than that of the previous phase
             flag_converged = True
+            if trace is not None:
+                trace.converged(instrumentation.STALLED if l_max_phase <= l_max else instrumentation.PHASE_LIMIT)
         else:
             l_max = l_max_phase # Set the max of this phase for the next phase
-            z = z_max_phase # Sets the starting partition of the next phase to the best partition found in this phase
+            z = np.copy(z_max_phase) # Sets the starting partition of the next phase to the best partition found in this phase
             z_max = z_max_phase
             pc+=1
             
-    return l_max, z, LL, pc
+    return l_max, z_max, LL, pc
 
-def get_partition_n(G, c = 2, trials = 1):
-    # Keep track of the data we need to return when we find the best partition found among the different times we run the algorithm
-    # Formatted as (likelihood, partition, recorded likelihoods, pc)
-    data_max = (-np.inf, [], [], 0)
-    
-    for i in range(trials):
-        data = get_partition(G, c = c)
-        if data[0] > data_max[0]:
-            data_max = data
-            
-    return data_max[1]
\ No newline at end of file
+def get_partition(G, c = 3, seed = None, trace = None, stop = None):
+    moves = partition_moves(G, c, seed, trace=trace, stop=stop)
+    try:
+        while True:
+            next(moves)
+    except StopIteration as done:
+        return done.value
+
+def refine_partition(G, z, c = 3, trace = None):
+    # Runs get_partition's phases from the partition z instead of a random one
+    # output : what get_partition returns
+    moves = partition_moves(G, c, z=z, trace=trace)
+    try:
+        while True:
+            next(moves)
+    except StopIteration as done:
+        return done.value
+
+def refine_local(G, z, c = 3, rng = None, sweeps = 20, batches = 8, trace = None):
+    # Refinement for get_partition_multilevel that scales to large graphs. get_partition's phases make one move per
+    # step and re-score every free node after each, which is quadratic in the boundary nodes. Here every sweep visits
+    # the boundary nodes in random batches, scores the moves of a whole batch at once against the current ers and kpr,
+    # and moves every node of the batch with a positive gain into its best group together. Those gains interact, so
+    # when moving them all lowers the log-likelihood only the better half is tried, down to the single best move
+    # (whose gain is exact). Stops after a sweep that moves nothing, or after sweeps sweeps.
+    #
+    # input  : z, the starting partition; rng, an optional np.random.Generator or seed for the order of the nodes
+    #        : batches, how many batches every sweep's boundary nodes are split into
+    # output : what get_partition returns, with the number of sweeps in place of the number of phases
+    rng = np.random.default_rng(rng)
+    driver = PhaseDriver(G, np.array(z, dtype=int), c)
+    LL = [driver.engine.logL]
+    reason = instrumentation.PHASE_LIMIT
+
+    if trace is not None:
+        trace.begin_run("local c = {}, n = {}".format(c, len(driver.z)))
+
+    for sweep in range(sweeps):
+        if trace is not None:
+            trace.begin_phase(sweep)
+
+        moved = 0
+        for batch in np.array_split(rng.permutation(driver.boundary()), batches):
+            if len(batch) == 0:
+                continue
+
+            scored, start = driver.scored, time.perf_counter()
+            gains = driver.node_gains(batch)
+            best = np.argmax(gains, axis=1)
+            gain = gains[np.arange(len(batch)), best]
+            if trace is not None:
+                trace.scored(driver.scored - scored, time.perf_counter() - start)
+
+            rank = np.argsort(-gain, kind="stable")
+            rank = rank[gain[rank] > 0]
+            nodes, groups = batch[rank], best[rank]
+            before = driver.engine.logL
+            count = len(nodes)
+            while count > 0:
+                previous = driver.z[nodes[:count]].copy()
+                driver.move_all(nodes[:count], groups[:count])
+                if driver.engine.logL > before:
+                    moved += count
+                    break
+                driver.move_all(nodes[:count], previous)
+                count = count // 2 if count > 1 else 0
+
+        LL.append(driver.engine.logL)
+        if trace is not None:
+            trace.end_phase(driver.engine.logL)
+        if moved == 0:
+            reason = instrumentation.STALLED
+            break
+
+    if trace is not None:
+        trace.converged(reason)
+
+    return driver.engine.logL, driver.z, LL, sweep + 1
+
+def iter_partition(G, c = 3, seed = None, interval = 0.25):
+    # Anytime version of get_partition for watching the optimizer as it runs
+    #
+    # output : yields (phase, step, z, logL) snapshots of the best partition found so far, at most one every
+    #          interval seconds, and then a final snapshot of the converged partition with step set to None
+    last = -np.inf
+    moves = partition_moves(G, c, seed)
+    try:
+        while True:
+            phase, step, z, logL = next(moves)
+            if time.perf_counter() - last >= interval:
+                last = time.perf_counter()
+                yield phase, step, np.copy(z), logL
+    except StopIteration as done:
+        l_max, z_max, LL, pc = done.value
+        yield pc, None, z_max, l_max
+
+# The stop event of get_partition_runs, handed to every worker process when it starts (events can't be pickled
+# along with each task)
+_stop_event = None
+
+def _set_stop_event(stop):
+    global _stop_event
+    _stop_event = stop
+
+def _get_partition_worker(G, c, seed):
+    return get_partition(G, c, seed, stop=_stop_event)
+
+def get_partition_runs(G, c = 2, trials = 1, processes = 1, seed = None, target = None, trace = None):
+    # Runs independent restarts of get_partition, spread across a process pool unless processes is 1
+    #
+    # input  : G a graph, c the number of groups, trials the number of restarts
+    #        : processes, the number of worker processes (None for one per core)
+    #        : seed, the root seed (or SeedSequence); every trial gets its own child seed spawned from it, so runs are reproducible
+    #        : target, a log-likelihood at which the trials that have not finished yet are abandoned (the running
+    #          ones stop after their current move)
+    #        : trace, an optional instrumentation.PartitionTrace (only recorded when processes is 1)
+    # output : the best log-likelihood, its partition, and the LL trace of each trial (None if it never finished)
+    G = graph_arrays(G) # converted once for every trial (and pickled to the workers as arrays)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(trials)
+    results = {} # trial -> (likelihood, partition, recorded likelihoods, pc)
+
+    def reached(data):
+        return target is not None and data[0] >= target
+
+    if processes == 1:
+        for trial in range(trials):
+            results[trial] = get_partition(G, c, seeds[trial], trace)
+            if reached(results[trial]):
+                break
+    else:
+        stop = multiprocessing.Event()
+        executor = ProcessPoolExecutor(processes, initializer=_set_stop_event, initargs=(stop,))
+        futures = {executor.submit(_get_partition_worker, G, c, seeds[trial]) : trial for trial in range(trials)}
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if reached(results[futures[future]]):
+                    break
+        finally:
+            # Drops the trials that have not started and stops the running ones, whose partial results are discarded
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    # Ties go to the earliest trial so the choice does not depend on which worker finished first
+    best = max(sorted(results), key=lambda trial: results[trial][0])
+    traces = [results[trial][2] if trial in results else None for trial in range(trials)]
+    return results[best][0], results[best][1], traces
+
+def get_partition_n(G, c = 2, trials = 1, processes = 1, seed = None, target = None, trace = None):
+    # Returns the best partition found among the different times we run the algorithm (see get_partition_runs)
+    return get_partition_runs(G, c, trials, processes, seed, target, trace)[1]
+
+def information_criterion(logL, n, m, c):
+    # BIC style score for choosing the number of groups c, lower is better: -2 logL, plus ln(m) for each of the
+    # c(c+1)/2 block parameters (ers), plus 2 ln(c) per node for encoding which group it belongs to
+    return -2*logL + c*(c + 1)/2*np.log(m) + 2*n*np.log(c)
+
+def split_partition(G, z, c, rng = None):
+    # Warm start for c + 1 groups: splits the group with the most stubs in two at random
+    arrays = graph_arrays(G)
+    kpr = np.bincount(z, weights=arrays.degrees, minlength=c)
+    z = np.array(z, dtype=int)
+    members = np.flatnonzero(z == np.argmax(kpr))
+    z[members[np.random.default_rng(rng).random(len(members)) < 0.5]] = c
+    return z
+
+def merge_partition(G, z, c):
+    # Warm start for c - 1 groups: merges the two groups with the most stubs between them relative to
+    # what their degrees would predict (the largest ers / (kpr[r] kpr[s])), then relabels the groups 0 to c-2
+    ers, kpr = tabulate_ek(G, z, c)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        affinity = ers / np.outer(kpr, kpr)
+    affinity[~np.isfinite(affinity) | np.eye(c, dtype=bool)] = -np.inf
+    r, s = sorted(np.unravel_index(np.argmax(affinity), affinity.shape))
+
+    z = np.where(np.asarray(z) == s, r, z)
+    return np.where(z > s, z - 1, z)
+
+def _sweep_cold(G, c, trials, seed):
+    return get_partition_runs(G, c, trials, 1, seed)[:2]
+
+def _sweep_warm(G, z, c):
+    return refine_partition(G, z, c)[:2]
+
+def sweep_c(G, cs, trials = 1, processes = None, seed = None):
+    # Partitions G for every number of groups in cs, in parallel across processes, for choosing c by model selection.
+    # Every c first gets independent restarts, then is warm started from a split of the best partition for c - 1
+    # and from a merge of the best partition for c + 1, keeping whichever is best.
+    #
+    # input  : cs, the numbers of groups to try; trials, processes and seed as in get_partition_runs
+    # output : a dictionary from each c to (logL, z, score), where score is the information_criterion (lower is better)
+    cs = sorted(cs)
+    arrays = graph_arrays(G)
+    seeds = np.random.SeedSequence(seed).spawn(2*len(cs))
+
+    with ProcessPoolExecutor(processes) as executor:
+        best = dict(zip(cs, executor.map(_sweep_cold, [arrays]*len(cs), cs, [trials]*len(cs), seeds[:len(cs)])))
+
+        starts = [] # (c, warm start partition)
+        for c, seed in zip(cs, seeds[len(cs):]):
+            if c - 1 in best and c - 1 >= 1:
+                starts.append((c, split_partition(arrays, best[c - 1][1], c - 1, seed)))
+            if c + 1 in best:
+                starts.append((c, merge_partition(arrays, best[c + 1][1], c + 1)))
+
+        warm = executor.map(_sweep_warm, [arrays]*len(starts), [z for c, z in starts], [c for c, z in starts])
+        for (c, z), result in zip(starts, warm):
+            if result[0] > best[c][0]:
+                best[c] = result
+
+    n, m = arrays.n, arrays.degrees.sum() / 2
+    return {c : (logL, z, information_criterion(logL, n, m, c)) for c, (logL, z) in best.items()}
+
+def coarsen(G, rng = None):
+    # Heavy-edge matching: visits the nodes in random order and pairs each unmatched node with the unmatched neighbor
+    # it shares the most stubs with (relative to that neighbor's degree), then merges every pair into a single node.
+    # The coarse adjacency P^T A P keeps every stub, so the merged pair's internal edges become a self loop and any
+    # coarse partition has exactly the ers, kpr (and log-likelihood) of the fine partition it projects to.
+    #
+    # input  : G a graph or GraphArrays, rng an optional np.random.Generator or seed
+    # output : groups, a n x 1 map from each node to its coarse node
+    #        : the coarse GraphArrays
+    arrays = graph_arrays(G)
+    adj = arrays.adj
+    match = np.full(arrays.n, -1)
+
+    for i in np.random.default_rng(rng).permutation(arrays.n):
+        if match[i] != -1:
+            continue
+
+        neighbors = adj.indices[adj.indptr[i]:adj.indptr[i + 1]]
+        stubs = adj.data[adj.indptr[i]:adj.indptr[i + 1]]
+        free = (match[neighbors] == -1) & (neighbors != i)
+        if free.any():
+            j = neighbors[free][np.argmax(stubs[free] / arrays.degrees[neighbors[free]])]
+            match[i], match[j] = j, i
+        else:
+            match[i] = i # nothing left to pair with, so it carries over on its own
+
+    groups = np.unique(np.minimum(np.arange(arrays.n), match), return_inverse=True)[1]
+    P = group_matrix(groups, groups.max() + 1)
+    return groups, GraphArrays(P.T @ adj @ P)
+
+def get_partition_multilevel(G, c = 2, trials = 1, processes = 1, seed = None, coarse_size = 100, trace = None):
+    # Multilevel DC-SBM for graphs too large for the node-by-node phases of get_partition. Coarsens the graph until it
+    # has at most coarse_size nodes, runs the restarts of get_partition_runs on the coarsest graph, then projects the
+    # partition back one level at a time and refines it there with the batched local moves of refine_local.
+    #
+    # input  : same as get_partition_runs, plus coarse_size the number of nodes to stop coarsening at
+    # output : the best partition found
+    rng = np.random.default_rng(seed)
+    levels = [] # (graph, groups) from the finest level to the coarsest
+    coarse = graph_arrays(G)
+
+    while coarse.n > max(coarse_size, c):
+        groups, coarser = coarsen(coarse, rng)
+        if coarser.n > 0.9*coarse.n:
+            break # The matching stalled (around hubs for instance), so further levels would barely shrink the graph
+        levels.append((coarse, groups))
+        coarse = coarser
+
+    z = get_partition_runs(coarse, c, trials, processes, int(rng.integers(2**32)), trace=trace)[1]
+    for graph, groups in reversed(levels):
+        z = refine_local(graph, z[groups], c, rng, trace=trace)[1]
+
+    return z
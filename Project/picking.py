@@ -0,0 +1,129 @@
+import numpy as np
+
+# Ray picking of the node spheres on the CPU. The node positions are kept in one contiguous array, bucketed into a
+# uniform grid (sorted by cell, with the start of every occupied cell), so a ray only tests the nodes in the cells it
+# passes through, all at once with NumPy. The grid holds every node and hidden nodes are filtered out per query, so
+# showing or hiding nodes doesn't rebuild it. The last answer is kept until the ray, the layout, or the shown nodes change.
+
+GRID_MIN_NODES = 2000 # Below this many nodes testing all of them at once is faster than walking the grid
+
+class NodePicker():
+    """Finds the shown sphere closest to the start of a ray segment among those the segment passes within radius of"""
+
+    def __init__(self, positions, visibility = None):
+        self.set_positions(positions)
+        self.set_visibility(visibility)
+
+    def set_visibility(self, visibility):
+        # input  : visibility, a boolean array of the shown nodes (in graph.nodes order) or None for all of them
+        self.visibility = visibility
+        self.last_ray = None
+
+    def set_positions(self, positions):
+        # Rebuilds the grid for a new layout
+        #
+        # input  : positions, n x 3 in graph.nodes order
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.last_ray = None
+
+        nodes = np.arange(len(self.positions))
+        if len(nodes) == 0:
+            self.order = nodes
+            return
+
+        # About one node per cell
+        points = self.positions
+        self.origin = points.min(axis=0)
+        extent = max(float((points.max(axis=0) - self.origin).max()), 1e-6)
+        self.cell = extent / max(len(nodes) ** (1 / 3), 1)
+        self.shape = np.floor((points.max(axis=0) - self.origin) / self.cell).astype(np.int64) + 1
+
+        keys = self.cell_keys(np.floor((points - self.origin) / self.cell).astype(np.int64))
+        sort = np.argsort(keys, kind="stable")
+        self.order = nodes[sort] # The nodes sorted by their cell
+        self.keys, self.starts = np.unique(keys[sort], return_index=True) # The occupied cells and their first node in order
+        self.stops = np.append(self.starts[1:], len(self.order))
+
+    def cell_keys(self, cells):
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    def pick(self, start, end, radius):
+        # Returns the index (in graph.nodes order) of the node to focus, or None when the ray misses every node
+        #
+        # input  : start and end, the ray segment in world space; radius, the radius of the spheres
+        ray = (tuple(map(float, start)), tuple(map(float, end)), float(radius))
+        if ray != self.last_ray:
+            self.last_ray = ray
+            self.last_node = self.find(np.array(ray[0]), np.array(ray[1]), ray[2])
+        return self.last_node
+
+    def find(self, start, end, radius):
+        if len(self.order) == 0:
+            return None
+
+        candidates = self.order if len(self.order) < GRID_MIN_NODES else self.candidates(start, end, radius)
+        if self.visibility is not None:
+            candidates = candidates[self.visibility[candidates]] # Hidden nodes can't be focused
+        if len(candidates) == 0:
+            return None
+
+        # The distance of every candidate to the segment and to its start
+        points = self.positions[candidates]
+        direction = end - start
+        along = np.clip((points - start) @ direction / max(direction @ direction, 1e-12), 0, 1)
+        distance = np.linalg.norm(points - (start + along[:, None] * direction), axis=1)
+        distance_to_start = np.linalg.norm(points - start, axis=1)
+
+        hit = distance < radius
+        if not hit.any():
+            return None
+        return int(candidates[hit][np.argmin(distance_to_start[hit])])
+
+    def candidates(self, start, end, radius):
+        # Returns the nodes in the cells the segment passes through, and in every cell within radius of those
+        margin = int(np.ceil(radius / self.cell))
+        if margin > 2:
+            return self.order # The spheres are large next to the cells (or the nodes are all in one spot), so test all of them
+        low = self.origin - margin * self.cell
+        high = self.origin + (self.shape + margin) * self.cell
+
+        # Clip the segment to the grid (padded by the margin) with the slab test
+        direction = end - start
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_low, t_high = (low - start) / direction, (high - start) / direction
+        inside = (start >= low) & (start <= high)
+        t_low = np.where(direction == 0, np.where(inside, -np.inf, np.inf), t_low)
+        t_high = np.where(direction == 0, np.where(inside, np.inf, -np.inf), t_high)
+        t0 = max(np.minimum(t_low, t_high).max(), 0)
+        t1 = min(np.maximum(t_low, t_high).min(), 1)
+        if t0 > t1:
+            return np.zeros(0, dtype=np.int64)
+
+        # The segment is in one cell between every pair of consecutive crossings of a cell boundary
+        crossings = [np.array([t0, t1])]
+        for axis in range(3):
+            if direction[axis] == 0:
+                continue
+            a, b = sorted(((start[axis] + t0 * direction[axis] - self.origin[axis]) / self.cell,
+                           (start[axis] + t1 * direction[axis] - self.origin[axis]) / self.cell))
+            planes = self.origin[axis] + np.arange(np.ceil(a), np.floor(b) + 1) * self.cell
+            crossings.append((planes - start[axis]) / direction[axis])
+        t = np.unique(np.concatenate(crossings))
+        t = (t[:-1] + t[1:]) / 2 if len(t) > 1 else t
+        cells = np.floor((start + t[:, None] * direction - self.origin) / self.cell).astype(np.int64)
+
+        # Spheres centered in neighboring cells can reach into the segment's cells
+        steps = np.arange(-margin, margin + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+        cells = (cells[:, None, :] + offsets[None, :, :]).reshape(-1, 3)
+        cells = cells[((cells >= 0) & (cells < self.shape)).all(axis=1)]
+        keys = np.unique(self.cell_keys(cells))
+
+        # The runs of nodes in the occupied ones
+        found = np.searchsorted(self.keys, keys)
+        occupied = found < len(self.keys)
+        occupied[occupied] = self.keys[found[occupied]] == keys[occupied]
+        first, last = self.starts[found[occupied]], self.stops[found[occupied]]
+        counts = last - first
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.order[np.repeat(first, counts) + offsets]
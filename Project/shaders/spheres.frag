@@ -1,13 +1,7 @@
 #version 330
 layout (location = 0) out vec4 FragColor; // This is sent to the first frame buffer that will go directly to the third pass
 layout (location = 1) out vec4 BrightColor;  // This will be sent to the second frame buffer for the blur effect
-
-struct Material {
-    vec3 ambient;
-    vec3 diffuse;
-    vec3 specular;
-    float shininess;
-}; 
+layout (location = 2) out int NodeID; // The node under every pixel, only kept when gpu picking is on
 
 struct Light {
     vec3 position;
@@ -16,7 +10,6 @@ struct Light {
     vec3 specular;
 };
   
-uniform Material material;
 uniform Light light;
 
 uniform vec3 light_pos; // The position of the light in world space
@@ -25,20 +18,28 @@ uniform vec3 camera_pos; // The position of the camera in world space
 
 in vec3 frag_pos;
 in vec3 normal; // Assumes that this is normalize already
+
+// The material of the node this sphere is drawn for (see spheres.vert)
+flat in vec3 material_ambient;
+flat in vec3 material_diffuse;
+flat in vec3 material_specular;
+flat in float material_shininess;
+flat in int node_id;
+
 void main() {
     // The ambient component of the light
-    vec3 ambient = light.ambient * material.ambient;
+    vec3 ambient = light.ambient * material_ambient;
 
     // The diffuse component of the light
     vec3 light_dir = normalize(light_pos - frag_pos); // Get the direction from the fragment to the light
     float diff = max(dot(normal, light_dir), 0.0); // Dot the normal with the light direction
-    vec3 diffuse = diff * light.diffuse * material.diffuse;
+    vec3 diffuse = diff * light.diffuse * material_diffuse;
 
     // The specular component of the light
     vec3 view_dir = normalize(camera_pos - frag_pos); // The direction from the fragment to the viewer
     vec3 halfway_dir = normalize(light_dir + view_dir); // Use the blinn-phong halfway vector
-    float spec = pow(max(dot(normal, halfway_dir), 0.0), material.shininess);
-    vec3 specular = spec * light.specular * material.specular;
+    float spec = pow(max(dot(normal, halfway_dir), 0.0), material_shininess);
+    vec3 specular = spec * light.specular * material_specular;
 
     // Sum up all components of the light
     vec3 result = ambient + diffuse + specular;
@@ -50,4 +51,6 @@ void main() {
         BrightColor = vec4(FragColor.rgb, 1.0);
     else
         BrightColor = vec4(0.0, 0.0, 0.0, 1.0);
+
+    NodeID = node_id;
 }
\ No newline at end of file
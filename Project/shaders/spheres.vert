@@ -4,15 +4,37 @@ uniform mat4 model_mat;
 uniform mat4 view_mat;
 uniform mat4 proj_mat;
 
-attribute vec3 vertex_position; // The vertex position
+attribute vec3 vertex_position; // The vertex position on the unit sphere
 attribute vec3 vertex_normal; // The normal
 
+// Every instance is one node, so these advance once per sphere instead of once per vertex
+attribute vec3 instance_position; // The position of the node
+attribute float instance_radius;
+attribute vec3 instance_ambient;
+attribute vec3 instance_diffuse;
+attribute vec3 instance_specular;
+attribute float instance_shininess;
+attribute float instance_node; // The index of the node, for gpu picking
+
 out vec3 frag_pos; // Outputs the vertex position in world space
 out vec3 normal; // Send the normal along to the fragment shader
 
+// The material of the node, which is the same for the whole sphere
+flat out vec3 material_ambient;
+flat out vec3 material_diffuse;
+flat out vec3 material_specular;
+flat out float material_shininess;
+flat out int node_id;
+
 void main() {
-    vec3 world_vec3 = vec3(model_mat * vec4(vertex_position, 1.0));
+    vec3 world_vec3 = vec3(model_mat * vec4(vertex_position * instance_radius + instance_position, 1.0));
     gl_Position =  proj_mat * view_mat * vec4(world_vec3, 1.0);
     normal = normalize(vertex_normal);
     frag_pos = world_vec3;
-}
\ No newline at end of file
+
+    material_ambient = instance_ambient;
+    material_diffuse = instance_diffuse;
+    material_specular = instance_specular;
+    material_shininess = instance_shininess;
+    node_id = int(instance_node + 0.5);
+}
@@ -1,4 +1,5 @@
 import sys
+import ctypes
 import OpenGL.GL as gl
 import OpenGL.GLUT as glut
 import OpenGL.GLU as glu
@@ -7,6 +8,7 @@ from OpenGL.GL import shaders
 import glm
 import numpy as np
 import highlighters as hl
+import picking
 from pathlib import Path
 
 # CREDIT from these tutorials
@@ -73,6 +75,34 @@ class Icosphere():
             triangles = self.subdivide(vertices, triangles)
         return vertices, triangles
 
+# An icosphere uploaded once into a vertex buffer and an index buffer on the gpu, which every RenderSpheres with
+# the same subdivisions draws from (see get_sphere_mesh)
+class SphereMesh():
+    def __init__(self, subdivisions):
+        vertices, triangles = Icosphere().make_icosphere(subdivisions)
+
+        # The unit sphere, which the vertex shader scales by the radius of every instance
+        self.vertex_data = np.array([[f for f in vec] for vec in vertices], 'f')
+        self.indices = np.array([f for vec in triangles for f in vec], 'uint32')
+        self.stride = len(self.vertex_data[0])*4 # n items per row, and each row is 4 bytes
+
+        self.vertex_vbo = vbo.VBO(self.vertex_data)
+        self.index_vbo = vbo.VBO(self.indices, target=gl.GL_ELEMENT_ARRAY_BUFFER)
+
+sphere_meshes = {} # The SphereMesh of every subdivision level that has been asked for
+
+def get_sphere_mesh(subdivisions):
+    if subdivisions not in sphere_meshes:
+        sphere_meshes[subdivisions] = SphereMesh(subdivisions)
+    return sphere_meshes[subdivisions]
+
+# Uploads the rows (sorted and unique) of data that changed into buffer, one glBufferSubData per run of consecutive rows
+def upload_rows(buffer, data, rows):
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    for run in np.split(rows, breaks):
+        if len(run):
+            buffer[run[0]:run[-1] + 1] = data[run[0]:run[-1] + 1]
+
 # Base class that provides some functions for rendering
 class Renderer:
     def approxCos(self, angle):
@@ -132,43 +162,125 @@ class Renderer:
 
 # Pass in a flattened list of edges and it will render them all
 # The highlighter determines what colors ands styles the lines have
+# With bucket_edges the edges are sorted by strength on the cpu, so the strong ones (plain lines) are drawn without
+# the geometry shader, and only the weak ones go through it to be drawn as animated stripes
 class RenderLine(Renderer):
-    def __init__(self):
+    MIN_STRIPE_PIXELS = 32 # Shorter edges on screen are drawn as plain lines, since their stripes couldn't be seen
+
+    def __init__(self, bucket_edges = True):
         self.shader = self.read_shaders("network_line.vert", "bloom_line.frag", "striped_line.geom")
+        self.bucket_edges = bucket_edges
 
-        uniforms = ['time', 'model_mat', 'view_mat', 'proj_mat']
+        uniforms = ['time', 'model_mat', 'view_mat', 'proj_mat', 'viewport', 'min_stripe_pixels']
         attributes = ['vertex_position', 'line_color', 'edge_strength']
         self.locations = self.get_locations(self.shader, uniforms, attributes)
 
+        self.plain_shader = self.read_shaders("line.vert", "bloom_line.frag")
+        uniforms = ['model_mat', 'view_mat', 'proj_mat']
+        attributes = ['vertex_position', 'line_color']
+        self.plain_locations = self.get_locations(self.plain_shader, uniforms, attributes)
+
     def set_highlighter(self, highlighter):
-        self.edges = [highlighter.get_layout()[node] for edge in highlighter.get_edges() for node in edge]
-        self.num_points = len(self.edges)
+        strengths = np.asarray(highlighter.get_edge_strengths(), 'f')
+
+        # The order the edges are stored in the vbos, and where every edge is stored
+        self.edge_order = np.argsort(strengths < 1, kind="stable") if self.bucket_edges else np.arange(len(strengths))
+        self.edge_rows = np.empty_like(self.edge_order)
+        self.edge_rows[self.edge_order] = np.arange(len(self.edge_order))
+        self.vertex_order = np.stack((2 * self.edge_order, 2 * self.edge_order + 1), axis=1).ravel()
+        self.num_plain = 2 * int(np.sum(strengths >= 1)) if self.bucket_edges else 0 # The vertices of the plain lines, which come first
+
+        self.endpoints = highlighter.get_edge_endpoints()
+        self.num_points = len(self.endpoints)
+
+        # The positions are in their own vbo, so a moving layout only uploads positions and the colors only colors
+        self.position_data = np.ascontiguousarray(highlighter.get_positions()[self.endpoints[self.vertex_order]], 'f')
+        self.position_vbo = vbo.VBO(self.position_data)
+
+        # Every row is a color and the edge strength, which is the same for both ends of an edge
+        self.attribute_data = np.empty((self.num_points, 5), 'f')
+        self.attribute_data[:, 0:4] = highlighter.get_edge_colors()[self.vertex_order]
+        self.attribute_data[:, 4] = np.repeat(strengths[self.edge_order], 2)
+        self.attribute_vbo = vbo.VBO(self.attribute_data)
+
+    # Only the colors changed, so overwrite them in place and let the vbo upload them with glBufferSubData on the next bind
+    def update_colors(self, highlighter):
+        self.attribute_data[:, 0:4] = highlighter.get_edge_colors()[self.vertex_order]
+        self.attribute_vbo[:] = self.attribute_data
+
+    # Only the positions changed (see Highlighter.animate_layout)
+    def update_layout(self, highlighter):
+        self.position_data[:] = highlighter.get_positions()[self.endpoints[self.vertex_order]]
+        self.position_vbo[:] = self.position_data
+
+    # Only the edges in highlighter.changed_edge_slots changed (see TemporalHighlighter), so only their two vertices
+    # are rewritten and uploaded, one glBufferSubData per run of consecutive rows
+    def update_slots(self, highlighter):
+        slots = highlighter.changed_edge_slots
+        if len(slots) == 0:
+            return
 
-        edge_strengths = highlighter.get_edge_strengths()
-        edge_strengths = [edge_strengths[int(np.floor(i / 2))] for i in range(len(edge_strengths * 2))]
-        the_vbo = [[*edges, *colors, edge_strength] for edges, colors, edge_strength in zip(self.edges, highlighter.get_edge_colors(), edge_strengths)]
-        self.vertex_vbo = vbo.VBO(np.array(the_vbo, 'f'))
+        edges = np.sort(self.edge_rows[slots])
+        rows = np.stack((2 * edges, 2 * edges + 1), axis=1).ravel()
+        self.endpoints = highlighter.get_edge_endpoints()
+        self.position_data[rows] = highlighter.get_positions()[self.endpoints[self.vertex_order[rows]]]
+        self.attribute_data[rows, 0:4] = highlighter.get_edge_colors()[self.vertex_order[rows]]
+
+        upload_rows(self.position_vbo, self.position_data, rows)
+        upload_rows(self.attribute_vbo, self.attribute_data, rows)
 
     def render(self, tick, offset, light_pos, context):
         model_mat = glm.translate(glm.mat4(1), glm.vec3(*offset))
 
+        if self.num_plain > 0:
+            self.render_plain(model_mat, context)
+        if self.num_points > self.num_plain:
+            self.render_striped(model_mat, tick, context)
+
+    # Draws the plain lines (the strong edges that come first in the vbos) straight to the screen
+    def render_plain(self, model_mat, context):
+        shaders.glUseProgram(self.plain_shader)
+        try:
+            try:
+                gl.glUniformMatrix4fv( self.plain_locations['model_mat'], 1, gl.GL_FALSE, glm.value_ptr(model_mat))
+                gl.glUniformMatrix4fv( self.plain_locations['view_mat'], 1, gl.GL_FALSE, glm.value_ptr(context.view_mat))
+                gl.glUniformMatrix4fv( self.plain_locations['proj_mat'], 1, gl.GL_FALSE, glm.value_ptr(context.proj_mat))
+                gl.glEnableVertexAttribArray( self.plain_locations["vertex_position"] )
+                gl.glEnableVertexAttribArray( self.plain_locations['line_color'] )
+                self.position_vbo.bind()
+                gl.glVertexAttribPointer(self.plain_locations["vertex_position"], 3, gl.GL_FLOAT,False, 3 * 4, self.position_vbo)
+                self.attribute_vbo.bind()
+                gl.glVertexAttribPointer(self.plain_locations["line_color"], 4, gl.GL_FLOAT,False, 5 * 4, self.attribute_vbo)
+                gl.glDrawArrays(gl.GL_LINES, 0, int(self.num_plain))
+            finally:
+                self.attribute_vbo.unbind()
+                gl.glDisableVertexAttribArray( self.plain_locations["line_color"] )
+                gl.glDisableVertexAttribArray( self.plain_locations["vertex_position"] )
+        finally:
+            shaders.glUseProgram(0) # Go back to the legacy pipeline
+
+    # Draws the rest of the lines through the geometry shader, which culls them and stripes the ones long enough on screen
+    def render_striped(self, model_mat, tick, context):
         shaders.glUseProgram(self.shader)
         try:
-            self.vertex_vbo.bind()
             try:
                 gl.glUniform1f(self.locations['time'], ((tick % 1000) * 0.001))
+                gl.glUniform2f(self.locations['viewport'], *context.resolution)
+                gl.glUniform1f(self.locations['min_stripe_pixels'], self.MIN_STRIPE_PIXELS)
                 gl.glUniformMatrix4fv( self.locations['model_mat'], 1, gl.GL_FALSE, glm.value_ptr(model_mat))
                 gl.glUniformMatrix4fv( self.locations['view_mat'], 1, gl.GL_FALSE, glm.value_ptr(context.view_mat))
                 gl.glUniformMatrix4fv( self.locations['proj_mat'], 1, gl.GL_FALSE, glm.value_ptr(context.proj_mat))
                 gl.glEnableVertexAttribArray( self.locations["vertex_position"] )
                 gl.glEnableVertexAttribArray( self.locations['line_color'] )
                 gl.glEnableVertexAttribArray( self.locations['edge_strength'] )
-                gl.glVertexAttribPointer(self.locations["vertex_position"], 3, gl.GL_FLOAT,False, 8 * 4, self.vertex_vbo)
-                gl.glVertexAttribPointer(self.locations["line_color"], 4, gl.GL_FLOAT,False, 8 * 4, self.vertex_vbo + 3 * 4)
-                gl.glVertexAttribPointer(self.locations["edge_strength"], 1, gl.GL_FLOAT,False, 8 * 4, self.vertex_vbo + 7 * 4)
-                gl.glDrawArrays(gl.GL_LINES, 0, int(self.num_points))
+                self.position_vbo.bind()
+                gl.glVertexAttribPointer(self.locations["vertex_position"], 3, gl.GL_FLOAT,False, 3 * 4, self.position_vbo)
+                self.attribute_vbo.bind()
+                gl.glVertexAttribPointer(self.locations["line_color"], 4, gl.GL_FLOAT,False, 5 * 4, self.attribute_vbo)
+                gl.glVertexAttribPointer(self.locations["edge_strength"], 1, gl.GL_FLOAT,False, 5 * 4, self.attribute_vbo + 4 * 4)
+                gl.glDrawArrays(gl.GL_LINES, int(self.num_plain), int(self.num_points - self.num_plain))
             finally:
-                self.vertex_vbo.unbind()
+                self.attribute_vbo.unbind()
                 gl.glDisableVertexAttribArray( self.locations["edge_strength"] )
                 gl.glDisableVertexAttribArray( self.locations["line_color"] )
                 gl.glDisableVertexAttribArray( self.locations["vertex_position"] )
@@ -177,29 +289,142 @@ class RenderLine(Renderer):
 
 # Renders n spheres at given positions (the positions are specified by the highlighter)
 # This is the only object that uses the material system and blinn-phong lighting
+# Every shown node is one instance of the same sphere mesh, so all of them are drawn with a single draw call
+# The mesh, the instance buffer and how the shader reads them are bound once in a vertex array object
 class RenderSpheres(Renderer):
+    # The columns of every row of the instance buffer, which is one row per node in graph.nodes order
+    INSTANCE_ATTRIBUTES = [("instance_position", 3), ("instance_radius", 1), ("instance_ambient", 3),
+                           ("instance_diffuse", 3), ("instance_specular", 3), ("instance_shininess", 1),
+                           ("instance_node", 1)]
+    INSTANCE_SIZE = sum(size for name, size in INSTANCE_ATTRIBUTES)
+
+    # What the focused node is drawn with
+    FOCUSED_MATERIAL = hl.Material((1, 1, 1), (1, 1, 1), (1, 1, 1), 1)
+
     def __init__(self, subdivisions = 1):
         self.shader = self.read_shaders("spheres.vert", "spheres.frag")
         uniforms = [
-        'material.ambient', 'material.diffuse', 'material.specular', 'material.shininess',
         'light.ambient', 'light.diffuse', 'light.specular', 'light_pos',
         'camera_pos', 'model_mat', 'view_mat', 'proj_mat']
-        attibutes = ['vertex_position', 'vertex_normal']
+        attibutes = ['vertex_position', 'vertex_normal'] + [name for name, size in self.INSTANCE_ATTRIBUTES]
         self.locations = self.get_locations(self.shader, uniforms, attibutes)
 
-        self.vertices, self.triangles = Icosphere().make_icosphere(subdivisions)
+        self.mesh = get_sphere_mesh(subdivisions)
+
+        self.focused_node = None
+        self.instance_vbo = None
+        self.vao = None
 
+    # Every node keeps the same instance row, so a change to a few nodes only rewrites and uploads their rows
     def set_highlighter(self, highlighter):
         self.radius = highlighter.get_node_radius()
-        self.positions = highlighter.get_layout().values()
+        self.positions = highlighter.get_positions()
         self.colors = highlighter.get_node_colors()
         self.light_color = highlighter.get_light_color()
+        self.focused_node = None
 
-        self.vertex_data = np.array([[f * self.radius for f in vec] for vec in self.vertices], 'f')
-        self.indices = np.array([f for vec in self.triangles for f in vec], 'uint32')
-        self.stride = len(self.vertex_data[0])*4 # n items per row, and each row is 4 bytes
+        n = len(self.positions)
+        self.instance_data = np.empty((n, self.INSTANCE_SIZE), 'f')
+        self.instance_data[:, 0:3] = self.positions
+        self.instance_data[:, 14] = np.arange(n)
+        self.write_visibility(highlighter.get_node_visibility())
+        self.write_materials()
+
+        if self.instance_vbo is None:
+            self.instance_vbo = vbo.VBO(self.instance_data)
+            self.setup_vertex_array()
+        else:
+            self.instance_vbo.set_array(self.instance_data) # Keeps the same buffer, so the vertex array still points at it
+
+    def update_colors(self, highlighter):
+        self.colors = highlighter.get_node_colors()
+        self.light_color = highlighter.get_light_color()
+        self.write_materials()
+        self.instance_vbo[:] = self.instance_data
+
+    def update_layout(self, highlighter):
+        self.positions = highlighter.get_positions()
+        self.instance_data[:, 0:3] = self.positions
+        self.instance_vbo[:] = self.instance_data
+
+    # Hidden nodes are drawn with a radius of 0. Only the rows of nodes (all of them if it is None) are rewritten
+    def update_visibility(self, highlighter, nodes = None):
+        visibility = highlighter.get_node_visibility()
+        if nodes is None:
+            self.write_visibility(visibility)
+            self.instance_vbo[:] = self.instance_data
+            return
+
+        nodes = np.sort(nodes)
+        self.instance_data[nodes, 3] = np.where(visibility[nodes], self.radius, 0)
+        upload_rows(self.instance_vbo, self.instance_data, nodes)
+
+    def write_visibility(self, visibility):
+        self.instance_data[:, 3] = self.radius if visibility is None else np.where(visibility, self.radius, 0)
+
+    # Records the mesh buffers and the instance buffer, and how every attribute is read from them, in a vertex array object
+    def setup_vertex_array(self):
+        self.vao = gl.glGenVertexArrays(1)
+        gl.glBindVertexArray(self.vao)
+        try:
+            self.mesh.vertex_vbo.bind()
+            gl.glEnableVertexAttribArray( self.locations["vertex_position"] )
+            gl.glEnableVertexAttribArray( self.locations["vertex_normal"] )
+            gl.glVertexAttribPointer(self.locations["vertex_position"], 3, gl.GL_FLOAT,False, self.mesh.stride, self.mesh.vertex_vbo)
+            gl.glVertexAttribPointer(self.locations["vertex_normal"], 3, gl.GL_FLOAT,False, self.mesh.stride, self.mesh.vertex_vbo)
+            self.mesh.index_vbo.bind()
+
+            # Every instance attribute advances once per sphere
+            self.instance_vbo.bind()
+            column = 0
+            for name, size in self.INSTANCE_ATTRIBUTES:
+                gl.glEnableVertexAttribArray( self.locations[name] )
+                gl.glVertexAttribPointer(self.locations[name], size, gl.GL_FLOAT, False, self.INSTANCE_SIZE * 4, self.instance_vbo + column * 4)
+                gl.glVertexAttribDivisor(self.locations[name], 1)
+                column += size
+        finally:
+            gl.glBindVertexArray(0) # Before unbinding the buffers, so the vertex array keeps the index buffer
+            self.mesh.vertex_vbo.unbind()
+            self.mesh.index_vbo.unbind()
+            self.instance_vbo.unbind()
+
+    # Copies the materials of the nodes into their instance rows, keeping the focused node highlighted
+    def write_materials(self):
+        self.instance_data[:, 4:7] = self.colors.ambient
+        self.instance_data[:, 7:10] = self.colors.diffuse
+        self.instance_data[:, 10:13] = self.colors.specular
+        self.instance_data[:, 13] = self.colors.shininess
+
+        if self.focused_node is not None:
+            self.write_material(self.focused_node, self.FOCUSED_MATERIAL)
+
+    def write_material(self, row, material):
+        self.instance_data[row, 4:7] = material.ambient
+        self.instance_data[row, 7:10] = material.diffuse
+        self.instance_data[row, 10:13] = material.specular
+        self.instance_data[row, 13] = material.shininess
+
+    # Draws node (or no node if it is None) with the focused material. Only the rows of the previously and newly focused
+    # nodes are rewritten and uploaded
+    def set_focused_node(self, node):
+        if node == self.focused_node:
+            return
+
+        previous, self.focused_node = self.focused_node, node
+        if previous is not None:
+            self.write_material(previous, self.colors[previous])
+            self.instance_vbo[previous:previous + 1] = self.instance_data[previous:previous + 1]
+        if node is not None:
+            self.write_material(node, self.FOCUSED_MATERIAL)
+            self.instance_vbo[node:node + 1] = self.instance_data[node:node + 1]
 
     def render(self, tick, offset, light_pos, context):
+        if len(self.instance_data) == 0:
+            return
+
+        # Use the model matrix to offset all of the spheres into world coordinates on the gpu
+        model_mat = glm.translate(glm.mat4(1), glm.vec3(*offset))
+
         shaders.glUseProgram(self.shader)
         try:
             gl.glUniform3f( self.locations['camera_pos'], *context.camera_pos )
@@ -207,41 +432,27 @@ class RenderSpheres(Renderer):
             gl.glUniform3f( self.locations['light.ambient'], *self.light_color.ambient )
             gl.glUniform3f( self.locations['light.diffuse'], *self.light_color.diffuse )
             gl.glUniform3f( self.locations['light.specular'], *self.light_color.specular )
+            gl.glUniformMatrix4fv( self.locations['model_mat'], 1, gl.GL_FALSE, glm.value_ptr(model_mat))
             gl.glUniformMatrix4fv( self.locations['view_mat'], 1, gl.GL_FALSE, glm.value_ptr(context.view_mat))
             gl.glUniformMatrix4fv( self.locations['proj_mat'], 1, gl.GL_FALSE, glm.value_ptr(context.proj_mat))
 
-            gl.glEnableVertexAttribArray( self.locations["vertex_position"] )
-            gl.glEnableVertexAttribArray( self.locations["vertex_normal"] )
-            gl.glVertexAttribPointer(
-                self.locations["vertex_position"],
-                3, gl.GL_FLOAT,False, self.stride, self.vertex_data
-            )
-            gl.glVertexAttribPointer(
-                self.locations["vertex_normal"],
-                3, gl.GL_FLOAT,False, self.stride, self.vertex_data
-            )
-            for position, material in zip(self.positions, self.colors):
-                gl.glUniform3f( self.locations['material.ambient'], *material.ambient )
-                gl.glUniform3f( self.locations['material.diffuse'], *material.diffuse)
-                gl.glUniform3f( self.locations['material.specular'], *material.specular )
-                gl.glUniform1f( self.locations['material.shininess'], material.shininess )
-
-                # Use the model matrix to offset each sphere into world coordinates on the gpu
-                model_mat = glm.translate(glm.mat4(1), glm.vec3(*offset) + glm.vec3(*position))
-                gl.glUniformMatrix4fv( self.locations['model_mat'], 1, gl.GL_FALSE, glm.value_ptr(model_mat))
-                
-                gl.glDrawElements(gl.GL_TRIANGLES, len(self.indices), gl.GL_UNSIGNED_INT, self.indices)
+            # Binding the instance buffer uploads the rows that changed since the last frame
+            self.instance_vbo.bind()
+            self.instance_vbo.unbind()
+
+            gl.glBindVertexArray(self.vao)
+            gl.glDrawElementsInstanced(gl.GL_TRIANGLES, len(self.mesh.indices), gl.GL_UNSIGNED_INT, None, len(self.instance_data))
         finally:
-            gl.glDisableVertexAttribArray( self.locations["vertex_position"] )
-            gl.glDisableVertexAttribArray( self.locations["vertex_normal"] )
+            gl.glBindVertexArray(0)
             shaders.glUseProgram(0) # Go back to the legacy pipeline
 
 # In charge of rendering a spring representation of the network
 # This is the main render, and holds all of the different passes and the
 # smaller components like the nodes, edges, and the renderer for the light as well.
 class NetworkRenderer(Renderer):
-    def __init__(self, highlighter, aspect):
+    def __init__(self, highlighter, aspect, gpu_picking = False):
         self.focused_node = None # Will keep a reference of the node that the pointer is currently hovering over
+        self.gpu_picking = gpu_picking # Whether the focused node is read back from an id buffer instead of found by ray tests
 
         self.light_renderer = RenderSpheres(subdivisions=2)
         self.nodes_renderer = RenderSpheres(subdivisions=2)
@@ -314,6 +525,20 @@ class NetworkRenderer(Renderer):
 
         gl.glDrawBuffers(2, [gl.GL_COLOR_ATTACHMENT0, gl.GL_COLOR_ATTACHMENT1])
 
+        # For gpu picking the node spheres also write the index of their node into a third, integer, color buffer
+        # Only the spheres are drawn into it (see render), so it holds the node that is in front at every pixel
+        if hasattr(self, "id_buffer"):
+            gl.glDeleteTextures(1, [self.id_buffer])
+            del self.id_buffer
+        if self.gpu_picking:
+            self.id_buffer = gl.glGenTextures(1)
+            gl.glBindTexture(gl.GL_TEXTURE_2D, self.id_buffer)
+            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R32I, *aspect, 0, gl.GL_RED_INTEGER, gl.GL_INT, None)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+            gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT2, gl.GL_TEXTURE_2D, self.id_buffer, 0)
+            self.setup_pick_buffers()
+
         # This is our custom depth buffer since we are replacing the default framebuffer
         # Without this depth buffer, the depth test fails
         rbo = gl.glGenRenderbuffers(1);
@@ -342,22 +567,45 @@ class NetworkRenderer(Renderer):
             gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
             gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, self.blur_tex_buffers[i], 0)
 
+    # Two pixel buffers that the node under the cursor is read into on alternate frames, so reading one back never
+    # waits on the gpu to finish the frame that is writing the other
+    def setup_pick_buffers(self):
+        if hasattr(self, "pick_buffers"):
+            return
+
+        self.pick_buffers = gl.glGenBuffers(2)
+        for buffer in self.pick_buffers:
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer)
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, 4, np.array([-1], np.int32), gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        self.pick_frame = 0
+        self.picked_id = np.array([-1], np.int32)
+        self.gpu_focused_node = None
+
+    def set_gpu_picking(self, gpu_picking):
+        self.gpu_picking = gpu_picking
+        self.setup_frame_buffer(self.aspect)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+
     def set_highlighter(self, highlighter):
         self.highlighter = highlighter
-        if self.focused_node != None:
-            self.nodes_renderer.colors[self.focused_node] = self.prev_focused_material
         self.focused_node = None
+        self.gpu_focused_node = None
+        self.nodes = list(highlighter.graph.nodes)
+        self.picker = picking.NodePicker(highlighter.get_positions(), highlighter.get_node_visibility())
         self.nodes_renderer.set_highlighter(highlighter)
         self.line_renderer.set_highlighter(highlighter)
         self.light_renderer.set_highlighter(hl.LightHighlighter())
 
     def render(self, tick, offset, light_pos, context):
+        self.apply_changes(self.highlighter.tick(tick))
 
-        # Reset the previously focused node back to its original color
-        if self.focused_node != None:
-            self.nodes_renderer.colors[self.focused_node] = self.prev_focused_material
-
-        self.focused_node = self.findFocusedNode(context, self.highlighter.get_node_radius())
+        # Make the focused node bright
+        if self.gpu_picking:
+            self.focused_node = self.gpu_focused_node # What was under the cursor a frame ago (see readFocusedNode)
+        else:
+            self.focused_node = self.findFocusedNode(context, self.highlighter.get_node_radius())
+        self.nodes_renderer.set_focused_node(self.focused_node)
 
         #
         # First pass (the normal render)
@@ -371,12 +619,15 @@ class NetworkRenderer(Renderer):
         gl.glClearColor(0, 0, 0, 1.0);
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT);
 
-        # Make the focused node bright
-        if self.focused_node != None:
-            self.prev_focused_material = self.nodes_renderer.colors[self.focused_node]
-            self.nodes_renderer.colors[self.focused_node] = hl.Material((1, 1, 1), (1, 1, 1), (1, 1, 1), 1)
-
-        self.nodes_renderer.render(tick, (0, 0, 0), light_pos, context)
+        if self.gpu_picking:
+            # Clear the ids to -1 (glClear is undefined for integer buffers) and let only the spheres write them
+            gl.glDrawBuffers(3, [gl.GL_COLOR_ATTACHMENT0, gl.GL_COLOR_ATTACHMENT1, gl.GL_COLOR_ATTACHMENT2])
+            gl.glClearBufferiv(gl.GL_COLOR, 2, np.array([-1, 0, 0, 0], np.int32))
+            self.nodes_renderer.render(tick, (0, 0, 0), light_pos, context)
+            gl.glDrawBuffers(2, [gl.GL_COLOR_ATTACHMENT0, gl.GL_COLOR_ATTACHMENT1])
+            self.readFocusedNode(context)
+        else:
+            self.nodes_renderer.render(tick, (0, 0, 0), light_pos, context)
 
         gl.glEnable(gl.GL_BLEND);
         gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA);  
@@ -432,6 +683,25 @@ class NetworkRenderer(Renderer):
 
         self.glutPrint(self.highlighter.name, pos=(5, 45))
 
+    # Passes what the highlighter reported as changed on to the renderers that draw it
+    def apply_changes(self, changes):
+        if hl.NODE_COLORS in changes:
+            self.nodes_renderer.update_colors(self.highlighter)
+        if hl.EDGE_COLORS in changes:
+            self.line_renderer.update_colors(self.highlighter)
+        if hl.LAYOUT in changes:
+            self.nodes_renderer.update_layout(self.highlighter)
+            self.line_renderer.update_layout(self.highlighter)
+        if hl.EDGES in changes:
+            self.line_renderer.set_highlighter(self.highlighter)
+        elif hl.EDGE_SLOTS in changes:
+            self.line_renderer.update_slots(self.highlighter)
+        if hl.NODE_VISIBILITY in changes:
+            self.nodes_renderer.update_visibility(self.highlighter, self.highlighter.changed_node_visibility)
+            self.picker.set_visibility(self.highlighter.get_node_visibility())
+        if hl.LAYOUT in changes:
+            self.picker.set_positions(self.highlighter.get_positions())
+
     # Helper function to render a screen quad across the viewport
     def renderScreenQuad(self, locations):
         self.quad_vbo.bind()
@@ -449,6 +719,7 @@ class NetworkRenderer(Renderer):
     # of the screen, which is the camera front vector I already have stored
     # For overhead perspective, it gets more complicated, but basically it convert the mouse window
     # coordinates into world space using the glm unProject method
+    # The picker only tests the ray again when it moved (the view or the mouse changed) or the layout changed
     def findFocusedNode(self, context, sphere_radius):
         max_focus_distance = 64
         x_1 = context.camera_pos
@@ -468,24 +739,32 @@ class NetworkRenderer(Renderer):
             # Convert world coordinates into a ray that goes in the direction of the mouse
             x_2 = glm.normalize(world_coord - x_1) * max_focus_distance + context.camera_pos
 
-        denominator = 1 / np.linalg.norm(x_2 - x_1)
-        closest_node = None
-        closest_distance = np.inf
-
-        for node, pos in self.highlighter.get_layout().items():
-            x_0 = glm.vec3(pos)
+        # Since it is a sphere, the collision is if the distance to the ray is within the radius
+        # Since multiple nodes could be within the line of sight, choose the one closest to the camera
+        index = self.picker.pick(x_1, x_2, sphere_radius)
+        return None if index is None else self.nodes[index]
 
-            # Minimize and find distance to the line
-            distance = np.linalg.norm(glm.cross(x_0 - x_1, x_0 - x_2)) * denominator
-            distance_to_camera = glm.distance(x_0, x_1)
-
-            # Since it is a sphere, the collision is if the distance to the line is within the radius
-            # Since multiple nodes could be within the line of sight, choose the one closest to the camera
-            if distance < sphere_radius and distance_to_camera < closest_distance:
-                closest_node = node
-                closest_distance = distance_to_camera
-
-        return closest_node
+    # Starts reading the node id under the cursor (or the center of the screen in first person) into one pixel buffer,
+    # and takes the id that was read into the other one on the previous frame, which the gpu has finished by now
+    def readFocusedNode(self, context):
+        if context.view_mode == 1:
+            x, y = self.aspect[0] // 2, self.aspect[1] // 2
+        else:
+            x, y = context.mouse_pos[0], self.aspect[1] - context.mouse_pos[1] - 1
+        x, y = int(np.clip(x, 0, self.aspect[0] - 1)), int(np.clip(y, 0, self.aspect[1] - 1))
+
+        gl.glReadBuffer(gl.GL_COLOR_ATTACHMENT2)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pick_buffers[self.pick_frame % 2])
+        gl.glReadPixels(x, y, 1, 1, gl.GL_RED_INTEGER, gl.GL_INT, ctypes.c_void_p(0))
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, self.pick_buffers[(self.pick_frame + 1) % 2])
+        gl.glGetBufferSubData(gl.GL_PIXEL_PACK_BUFFER, 0, 4, self.picked_id)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        gl.glReadBuffer(gl.GL_COLOR_ATTACHMENT0)
+        self.pick_frame += 1
+
+        # The id can be from before the highlighter changed for a frame
+        picked = int(self.picked_id[0])
+        self.gpu_focused_node = self.nodes[picked] if 0 <= picked < len(self.nodes) else None
 
     # Print some text to opengl
     def glutPrint(self, string, pos=(5, 5)):
@@ -532,7 +811,7 @@ class Crosshair(Renderer):
             shaders.glUseProgram(0) # Go back to the legacy pipeline
 
 class Context:
-    def __init__(self, highlighters, view_mode, resolution):
+    def __init__(self, highlighters, view_mode, resolution, gpu_picking = False):
         self.tick = 0 # World ticks in milleseconds
         self.fov = 55 # Field of view
         self.resolution = resolution
@@ -547,7 +826,7 @@ class Context:
         self.warp = False; # To keep the motion function from being called after we warp the mouse pointer
         self.highlighter = 0
         self.highlighters = highlighters
-        self.renderer = NetworkRenderer(self.highlighters[self.highlighter], self.resolution)
+        self.renderer = NetworkRenderer(self.highlighters[self.highlighter], self.resolution, gpu_picking)
         self.mouse_pos = (0, 0)
         self.move_light = False # Option to have a moving test light
 
@@ -709,14 +988,17 @@ class Context:
             glut.glutPostRedisplay()
         elif key == b'l':
             self.move_light = not self.move_light
+        elif key == b'p':
+            self.renderer.set_gpu_picking(not self.renderer.gpu_picking)
 
     def idle(self):
         self.tick = glut.glutGet(glut.GLUT_ELAPSED_TIME);
         self.delta_time = self.tick - self.prev_frame_time
         self.prev_frame_time = self.tick
 
-def visualize(highlighters=None, view_mode=1, resolution=(1280, 720)):
-    """Generates an opengl window that renders the given network"""
+def visualize(highlighters=None, view_mode=1, resolution=(1280, 720), gpu_picking=False):
+    """Generates an opengl window that renders the given network. With gpu_picking the focused node is read back from
+    an id buffer drawn with the nodes instead of found with ray tests on the cpu (toggle with p)"""
 
     if highlighters == None:
         print("No highlighter specified: nothing to show")
@@ -727,5 +1009,5 @@ def visualize(highlighters=None, view_mode=1, resolution=(1280, 720)):
     except TypeError as te:
         highlighters = [highlighters]
 
-    Context(highlighters, view_mode, resolution)
+    Context(highlighters, view_mode, resolution, gpu_picking)
     glut.glutMainLoop()